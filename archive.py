@@ -0,0 +1,320 @@
+"""Архивация старых строк mss_chat в сжатые файлы и их обратная загрузка.
+
+    python archive.py run [--older-than 180] [--format ndjson|csv] [--compression gzip|zstd]
+    python archive.py restore archive/manifest.ndjson [--file ИМЯ]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_DIR,
+    ARCHIVE_FORMAT,
+    ARCHIVE_COMPRESSION,
+    ARCHIVE_CHUNK_HOURS,
+    ARCHIVE_INTERVAL_SEC,
+    ARCHIVE_MAX_CHUNKS,
+    ARCHIVE_TIMEOUT,
+)
+from db import get_db_connection, create_pool, close_pool
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'username', 'message_text', 'message_type', 'created_at')
+MANIFEST_NAME = 'manifest.ndjson'
+RESTORE_BATCH = 5000
+
+# Разделитель и кавычка, которых нет в JSON от row_to_json: строка уходит из COPY как есть
+NDJSON_COPY_OPTIONS = {'format': 'csv', 'delimiter': '\x02', 'quote': '\x01'}
+
+def open_compressed(path, mode, compression):
+    """Потоковое (де)сжатие файла: gzip из стандартной библиотеки или zstd"""
+    if compression == 'gzip':
+        return gzip.open(path, mode + 'b')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the zstandard package") from None
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    raise ValueError(f"Unknown compression: {compression}")
+
+def file_extension(fmt, compression):
+    return f".{fmt}." + ('gz' if compression == 'gzip' else 'zst')
+
+def copy_query(fmt):
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    select = f'''
+        SELECT {columns} FROM mss_chat
+        WHERE created_at >= $1 AND created_at < $2
+        ORDER BY created_at, id
+    '''
+    if fmt == 'ndjson':
+        return f'SELECT row_to_json(t)::text FROM ({select}) AS t', NDJSON_COPY_OPTIONS
+    return select, {'format': 'csv', 'header': True}
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def append_manifest(directory, entry):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+async def archive_chunk(conn, directory, start, end, fmt, compression):
+    """Один диапазон [start, end): COPY в файл, fsync, затем DELETE этого диапазона.
+
+    COPY и DELETE идут в одной транзакции REPEATABLE READ, поэтому
+    удаляются ровно выгруженные строки. Запись в манифест делается до
+    COMMIT: если COMMIT не случится, диапазон выгрузится повторно в тот же
+    файл, а при загрузке по манифесту берётся последняя запись о файле.
+
+    Сжатие и fsync идут в потоке (asyncio.to_thread): фоновая архивация
+    работает в цикле событий бота и не должна задерживать хэндлеры.
+    """
+    name = f"mss_chat_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}{file_extension(fmt, compression)}"
+    path = os.path.join(directory, name)
+    part = path + '.part'
+    query, options = copy_query(fmt)
+
+    async with conn.transaction(isolation='repeatable_read'):
+        out = open_compressed(part, 'w', compression)
+        try:
+            async def write(data):
+                await asyncio.to_thread(out.write, data)
+
+            status = await conn.copy_from_query(
+                query, start, end, output=write, timeout=ARCHIVE_TIMEOUT, **options
+            )
+        finally:
+            await asyncio.to_thread(out.close)
+
+        rows = int(status.split()[-1])
+        if rows == 0:
+            os.remove(part)
+            return 0
+
+        # Файл на диске до того, как строки исчезнут из БД
+        await asyncio.to_thread(fsync_path, part)
+        os.replace(part, path)
+        await asyncio.to_thread(fsync_path, directory)
+
+        deleted = await conn.execute(
+            'DELETE FROM mss_chat WHERE created_at >= $1 AND created_at < $2', start, end,
+            timeout=ARCHIVE_TIMEOUT,
+        )
+        await asyncio.to_thread(append_manifest, directory, {
+            'file': name,
+            'table': 'mss_chat',
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'rows': rows,
+            'deleted': int(deleted.split()[-1]),
+            'format': fmt,
+            'compression': compression,
+            'columns': list(ARCHIVE_COLUMNS),
+            'archived_at': datetime.now().isoformat(),
+        })
+    return rows
+
+async def drop_empty_partitions(conn, cutoff):
+    """Удаление опустевших помесячных секций целиком старше cutoff"""
+    rows = await conn.fetch('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'mss_chat'::regclass AND c.relname ~ '^mss_chat_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY c.relname
+    ''')
+    dropped = 0
+    for row in rows:
+        name = row['relname']
+        month = datetime(int(name[10:14]), int(name[15:17]), 1)
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        if next_month > cutoff:
+            continue
+        if await conn.fetchval(f'SELECT NOT EXISTS (SELECT 1 FROM "{name}")', timeout=ARCHIVE_TIMEOUT):
+            await conn.execute(f'DROP TABLE "{name}"', timeout=ARCHIVE_TIMEOUT)
+            dropped += 1
+    return dropped
+
+async def archive_old_messages(older_than_days, directory=ARCHIVE_DIR, fmt=ARCHIVE_FORMAT,
+                               compression=ARCHIVE_COMPRESSION, chunk_hours=ARCHIVE_CHUNK_HOURS,
+                               max_chunks=None):
+    """Выгрузка строк старше older_than_days диапазонами по chunk_hours часов.
+
+    Память не зависит от объёма: COPY отдаёт данные порциями прямо в
+    потоковый компрессор. Каждый диапазон берёт соединение из пула
+    отдельно; max_chunks ограничивает число диапазонов за запуск.
+    Возвращает число перенесённых строк.
+    """
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError(f"Unknown archive format: {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=older_than_days), datetime.min.time())
+    step = timedelta(hours=chunk_hours)
+
+    total = 0
+    chunks = 0
+    start = archived_until(directory)
+    while max_chunks is None or chunks < max_chunks:
+        async with get_db_connection() as conn:
+            if not conn:
+                return total if chunks else None
+
+            # Следующий день с сообщениями — по дневным сводкам, без сканирования
+            # mss_chat; пустые промежутки пропускаются целиком
+            next_day = await conn.fetchval(
+                'SELECT min(day) FROM mss_chat_daily WHERE day >= $1', start.date() if start else date.min,
+            )
+            if next_day is None:
+                break
+            day_start = datetime.combine(next_day, datetime.min.time())
+            start = max(start, day_start) if start else day_start
+            if start >= cutoff:
+                break
+
+            end = min(start + step, cutoff)
+            rows = await archive_chunk(conn, directory, start, end, fmt, compression)
+        if rows:
+            logging.info(f"Archive: {rows} rows from {start} to {end}")
+        total += rows
+        chunks += 1
+        start = end
+    else:
+        logging.info(f"Archive: stopped after {chunks} ranges, the rest goes in the next run "
+                     f"(python archive.py run archives the whole backlog)")
+
+    async with get_db_connection() as conn:
+        if not conn:
+            return total
+        dropped = await drop_empty_partitions(conn, cutoff)
+    if dropped:
+        logging.info(f"Archive: dropped {dropped} empty mss_chat partitions")
+    return total
+
+async def run_archive_maintenance(older_than_days=ARCHIVE_AFTER_DAYS, interval=ARCHIVE_INTERVAL_SEC,
+                                  max_chunks=ARCHIVE_MAX_CHUNKS):
+    """Фоновая архивация в процессе бота: небольшими запусками, по max_chunks диапазонов"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await archive_old_messages(older_than_days, max_chunks=max_chunks)
+        except Exception as e:
+            logging.error(f"Error archiving mss_chat: {e}")
+
+def archived_until(directory):
+    """Конец последнего выгруженного диапазона по манифесту или None.
+
+    Сводки mss_chat_daily хранят и уже выгруженные дни, поэтому без этой
+    точки каждый запуск заново проходил бы всю историю.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    ends = [entry['to'] for entry in read_manifest(path) if entry.get('table') == 'mss_chat']
+    return datetime.fromisoformat(max(ends)) if ends else None
+
+def read_manifest(path):
+    """Записи манифеста; для каждого файла — последняя"""
+    entries = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry['file']] = entry
+    return sorted(entries.values(), key=lambda entry: entry['from'])
+
+def iter_ndjson_records(stream, columns):
+    for line in stream:
+        row = json.loads(line)
+        row['created_at'] = datetime.fromisoformat(row['created_at'])
+        yield tuple(row[column] for column in columns)
+
+async def restore_entry(conn, directory, entry):
+    """Загрузка одного архива обратно в mss_chat (строки с теми же id)"""
+    path = os.path.join(directory, entry['file'])
+    columns = entry['columns']
+
+    async with conn.transaction():
+        await conn.fetchval(
+            'SELECT mss_chat_ensure_partitions($1::date, $2::date)',
+            datetime.fromisoformat(entry['from']).date(), datetime.fromisoformat(entry['to']).date(),
+        )
+        with open_compressed(path, 'r', entry['compression']) as stream:
+            if entry['format'] == 'csv':
+                await conn.copy_to_table(
+                    'mss_chat', source=stream, columns=columns, format='csv', header=True,
+                    timeout=ARCHIVE_TIMEOUT,
+                )
+            else:
+                import io
+                batch = []
+                for record in iter_ndjson_records(io.TextIOWrapper(stream, encoding='utf-8'), columns):
+                    batch.append(record)
+                    if len(batch) >= RESTORE_BATCH:
+                        await conn.copy_records_to_table('mss_chat', records=batch, columns=columns, timeout=ARCHIVE_TIMEOUT)
+                        batch = []
+                if batch:
+                    await conn.copy_records_to_table('mss_chat', records=batch, columns=columns, timeout=ARCHIVE_TIMEOUT)
+
+async def restore(manifest_path, only_file=None):
+    directory = os.path.dirname(manifest_path) or '.'
+    restored = 0
+    async with get_db_connection() as conn:
+        if not conn:
+            return None
+        for entry in read_manifest(manifest_path):
+            if only_file and entry['file'] != only_file:
+                continue
+            await restore_entry(conn, directory, entry)
+            restored += entry['rows']
+            logging.info(f"Restore: {entry['file']} ({entry['rows']} rows)")
+    return restored
+
+async def main():
+    parser = argparse.ArgumentParser(description="Архивация mss_chat")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="выгрузить и удалить старые строки")
+    run_parser.add_argument('--older-than', type=int, default=ARCHIVE_AFTER_DAYS or 180, help="дней")
+    run_parser.add_argument('--dir', default=ARCHIVE_DIR)
+    run_parser.add_argument('--format', choices=('ndjson', 'csv'), default=ARCHIVE_FORMAT)
+    run_parser.add_argument('--compression', choices=('gzip', 'zstd'), default=ARCHIVE_COMPRESSION)
+    run_parser.add_argument('--chunk-hours', type=int, default=ARCHIVE_CHUNK_HOURS)
+
+    restore_parser = commands.add_parser('restore', help="загрузить архивы по манифесту")
+    restore_parser.add_argument('manifest')
+    restore_parser.add_argument('--file', help="только этот архив")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    await create_pool()
+    try:
+        if args.command == 'run':
+            result = await archive_old_messages(
+                args.older_than, args.dir, args.format, args.compression, args.chunk_hours
+            )
+        else:
+            result = await restore(args.manifest, args.file)
+        if result is None:
+            logging.error("Database unavailable")
+        else:
+            logging.info(f"Done: {result} rows")
+    finally:
+        await close_pool()
+
+if __name__ == '__main__':
+    asyncio.run(main())
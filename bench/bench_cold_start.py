@@ -0,0 +1,111 @@
+"""Холодный старт: время импорта bot и время до первого ответа.
+
+Каждый замер — новый процесс Python, как при перезапуске на Render.
+Время до первого ответа считается снаружи: от запуска процесса до
+момента, когда бот отправил ответ на /start. Bot API заменён на
+FakeSession с задержкой --api-latency на запрос; с DATABASE_URL
+прогревается настоящая БД. --sequential повторяет старый порядок
+(Bot API и БД по очереди) для сравнения.
+
+Запуск: python -m bench.bench_cold_start [--runs 5] [--api-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench.fake_session import FAKE_TOKEN
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", FAKE_TOKEN)
+    env["PYTHONPATH"] = ROOT
+    return env
+
+def measure_import(runs):
+    code = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], env=child_env(), cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        results.append(float(out.stdout.strip().splitlines()[-1]))
+    return results
+
+def top_imports(limit):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], env=child_env(),
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Только модули верхнего уровня bot и его прямые зависимости
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+def measure_first_reply(runs, api_latency, sequential):
+    results = []
+    for _ in range(runs):
+        args = [sys.executable, "-m", "bench.bench_cold_start", "--child", "--api-latency", str(api_latency)]
+        if sequential:
+            args.append("--sequential")
+        started = time.perf_counter()
+        subprocess.run(args, env=child_env(), cwd=ROOT, capture_output=True, text=True, check=True)
+        results.append(time.perf_counter() - started)
+    return results
+
+async def child(api_latency, sequential):
+    """Процесс-замер: старт как в main() и ответ на первый /start"""
+    os.environ.setdefault("THROTTLE_ENABLED", "0")
+    from bench.fake_session import FakeSession
+    from bench.bench_load import build_update
+    import bot as bot_module
+
+    session = FakeSession(latency=api_latency)
+    bot_module.bot.session = session
+    if sequential:
+        await bot_module.bot.delete_webhook()
+        await bot_module.bot.me()
+        await bot_module.warm_up_database()
+    else:
+        await bot_module.prepare_polling()
+    await bot_module.dp.feed_update(bot_module.bot, build_update(1, 1000, "message", "/start"))
+    assert any(method == "sendMessage" for method, _ in session.calls)
+    # Сразу выходим: ответ отправлен, остановка в замер не входит
+    os._exit(0)
+
+def report(title, values):
+    values = sorted(values)
+    print(f"{title}: медиана {statistics.median(values) * 1000:.0f} мс, "
+          f"мин {values[0] * 1000:.0f} мс, макс {values[-1] * 1000:.0f} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка Bot API, с")
+    parser.add_argument("--sequential", action="store_true", help="старый порядок запуска")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.api_latency, args.sequential))
+        return
+
+    report("import bot", measure_import(args.runs))
+    print("  самые тяжёлые импорты:")
+    for cumulative, name in top_imports(8):
+        print(f"    {cumulative / 1000:8.1f} мс  {name}")
+
+    report(f"до первого ответа (Bot API {args.api_latency * 1000:.0f} мс)",
+           measure_first_reply(args.runs, args.api_latency, False))
+    report("  то же, запуск по очереди",
+           measure_first_reply(args.runs, args.api_latency, True))
+
+if __name__ == "__main__":
+    main()
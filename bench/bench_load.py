@@ -0,0 +1,222 @@
+"""Нагрузочный прогон бота: синтетические обновления через dp.feed_update.
+
+Каждый виртуальный пользователь проходит сценарий: /start, все кнопки
+меню, полный мини тест, вопрос в поддержку через кнопку меню и через
+inline-кнопку. Пользователи работают параллельно (--concurrency), внутри
+сценария обновления идут по порядку, как в Telegram.
+
+Bot API заменён на FakeSession (планировщик отправки в замер не входит).
+С DATABASE_URL работает настоящая БД — лучше отдельная, тестовая: бот
+пишет в неё пользователей, журнал и результаты тестов. Запросы к БД
+считаются через Connection.add_query_logger, COPY — отдельно; фоновые
+записи (журнал, last_activity) сбрасываются до подсчёта.
+
+Запуск: DATABASE_URL=postgresql://localhost/mss_bench python -m bench.bench_load [--users N] [--concurrency C] [--json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import time
+
+from bench.fake_session import FAKE_TOKEN, FakeSession
+
+os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+# Сценарии шлют сообщения быстрее любого человека — антифлуд их бы отбросил
+os.environ.setdefault("THROTTLE_ENABLED", "0")
+
+import asyncpg
+from aiogram.types import Update
+
+import bot as bot_module
+import db
+from chat_log import chat_log
+from pg_storage import PostgresStorage
+from user_cache import user_profiles
+
+FIRST_USER_ID = 10_000_000
+QUIZ_BUTTON = "🧩 Мини тест"
+SUPPORT_BUTTON = "🆘 Связаться с поддержкой"
+
+class DbCounter:
+    """Счётчик обращений к БД по всем соединениям пула"""
+
+    def __init__(self):
+        self.queries = 0
+        self.copies = 0
+        self.query_time = 0.0
+
+    async def attach(self, conn):
+        conn.add_query_logger(self._on_query)
+
+    def _on_query(self, record):
+        self.queries += 1
+        self.query_time += record.elapsed
+
+    def count_copies(self):
+        """COPY идёт мимо add_query_logger — считаем его обёрткой метода"""
+        original = asyncpg.connection.Connection.copy_records_to_table
+        counter = self
+
+        async def copy_records_to_table(self, *args, **kwargs):
+            counter.copies += 1
+            return await original(self, *args, **kwargs)
+
+        asyncpg.connection.Connection.copy_records_to_table = copy_records_to_table
+
+def user_script(user_id, rng):
+    """Последовательность (тип, данные) обновлений одного пользователя"""
+    script = [("message", "/start")]
+    for button in bot_module.MENU_SECTIONS:
+        if button not in (QUIZ_BUTTON, SUPPORT_BUTTON):
+            script.append(("message", button))
+
+    script.append(("message", QUIZ_BUTTON))
+    for question in bot_module.MINI_TEST.questions:
+        if question.options:
+            script.append(("message", rng.choice(question.options)))
+        else:
+            script.append(("message", f"Ответ пользователя {user_id}"))
+
+    script.append(("message", SUPPORT_BUTTON))
+    script.append(("message", f"Вопрос от {user_id}: когда начинается курс?"))
+    script.append(("callback", "support"))
+    script.append(("message", f"Ещё вопрос от {user_id}"))
+    script.append(("message", "просто текст"))
+    return script
+
+def update_payload(update_id, user_id, kind, data):
+    """JSON обновления в формате Bot API"""
+    user = {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user,
+        "text": data,
+    }
+    if kind == "callback":
+        message["from"] = {"id": 123456, "is_bot": True, "first_name": "Bench"}
+        message["text"] = "🆘"
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": message,
+            },
+        }
+    return {"update_id": update_id, "message": message}
+
+def build_update(update_id, user_id, kind, data):
+    return Update.model_validate(update_payload(update_id, user_id, kind, data))
+
+def build_workload(users, seed):
+    """Все обновления строятся заранее, чтобы валидация не попала в замер"""
+    rng = random.Random(seed)
+    update_id = 0
+    workload = []
+    for index in range(users):
+        user_id = FIRST_USER_ID + index
+        updates = []
+        for kind, data in user_script(user_id, rng):
+            update_id += 1
+            updates.append(build_update(update_id, user_id, kind, data))
+        workload.append(updates)
+    return workload
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def run(users, concurrency, seed):
+    counter = DbCounter()
+    await db.create_pool(init=counter.attach)
+    database = db.pool is not None
+    if database:
+        counter.count_copies()
+        await bot_module.init_database()
+        user_profiles.start()
+        if isinstance(bot_module.dp.storage, PostgresStorage):
+            bot_module.dp.storage.start()
+    else:
+        # Без БД журнал только теряет пакеты — ошибки об этом не нужны
+        logging.disable(logging.ERROR)
+    chat_log.start()
+
+    session = FakeSession(record=False)
+    bot_module.bot.session = session
+    workload = build_workload(users, seed)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def virtual_user(updates):
+        async with semaphore:
+            for update in updates:
+                started = time.perf_counter()
+                await bot_module.dp.feed_update(bot_module.bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    # Замер счётчиков БД только по нагрузке, без миграций
+    queries_before, copies_before = counter.queries, counter.copies
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(updates) for updates in workload))
+    elapsed = time.perf_counter() - started
+
+    # Фоновые пакеты относятся к этим же обновлениям
+    await chat_log.stop()
+    await user_profiles.stop()
+    await bot_module.dp.storage.close()
+    await db.close_pool()
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        "updates": total,
+        "users": users,
+        "concurrency": concurrency,
+        "database": database,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "db_queries_per_update": round((counter.queries - queries_before) / total, 3),
+        "db_copies_per_update": round((counter.copies - copies_before) / total, 3),
+        "api_calls_per_update": round(session.count / total, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="одна строка JSON для сравнения релизов")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.users, args.concurrency, args.seed))
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    if not report["database"]:
+        print("DATABASE_URL не задан: замер без БД")
+    print(f"{report['updates']} обновлений от {report['users']} пользователей "
+          f"(параллельно {report['concurrency']}) за {report['seconds']} с")
+    print(f"  {report['updates_per_sec']} обновлений/с")
+    print(f"  задержка, мс: p50 {report['p50_ms']}  p95 {report['p95_ms']}  "
+          f"p99 {report['p99_ms']}  max {report['max_ms']}")
+    print(f"  на обновление: запросов к БД {report['db_queries_per_update']}, "
+          f"COPY {report['db_copies_per_update']}, вызовов Bot API {report['api_calls_per_update']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Микробенчмарк ответов: сборка клавиатуры и SendMessage на каждый вызов
+против заранее подготовленных payloads.py.
+
+Запуск: python -m bench.bench_payloads [--iterations N]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import time
+import tracemalloc
+
+from bench.fake_session import FAKE_TOKEN, FakeSession
+
+os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+
+from aiogram.types import KeyboardButton, Message, ReplyKeyboardMarkup
+
+import bot as bot_module
+from payloads import answer_static
+
+def legacy_main_keyboard():
+    """Старый get_main_keyboard(): новое дерево моделей на каждый вызов"""
+    return ReplyKeyboardMarkup(keyboard=[
+        [KeyboardButton(text="📚 Узнать о курсе"), KeyboardButton(text="👥 Для какого возраста")],
+        [KeyboardButton(text="📋 Формат занятий"), KeyboardButton(text="🎯 Результаты курса")],
+        [KeyboardButton(text="⏰ Как проходят занятия"), KeyboardButton(text="💰 Оплата")],
+        [KeyboardButton(text="🆘 Связаться с поддержкой"), KeyboardButton(text="🧩 Мини тест")]
+    ], resize_keyboard=True)
+
+WELCOME_TEXT = "Здравствуйте! Добро пожаловать!\n\n" * 8
+SECTION_TEXT = "📚 Узнать подробнее о курсе \"Излагай ясно\"\n\n" * 40
+
+async def legacy_start(message):
+    await message.answer(WELCOME_TEXT, reply_markup=legacy_main_keyboard())
+
+async def prebuilt_start(message):
+    await answer_static(message, WELCOME_TEXT, reply_markup=bot_module.get_main_markup())
+
+async def legacy_section(message):
+    await message.answer(SECTION_TEXT)
+
+async def prebuilt_section(message):
+    await answer_static(message, SECTION_TEXT)
+
+def make_message(bot):
+    return Message.model_validate({
+        "message_id": 1,
+        "date": datetime.datetime.now(),
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Bench"},
+        "text": "/start",
+    }, context={"bot": bot})
+
+async def measure(name, reply, message, iterations):
+    for _ in range(100):
+        await reply(message)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await reply(message)
+    elapsed = time.perf_counter() - started
+
+    # Пиковый объём памяти, выделяемой за один ответ
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(1000):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await reply(message)
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    per_call_us = elapsed / iterations * 1e6
+    print(f"{name:<10} {per_call_us:9.1f} us/call {peak_total / 1000:9.0f} B peak/call")
+    return per_call_us
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    session = FakeSession(record=False)
+    bot_module.bot.session = session
+    message = make_message(bot_module.bot)
+
+    for path, legacy, prebuilt in (
+        ("start_handler", legacy_start, prebuilt_start),
+        ("handle_*", legacy_section, prebuilt_section),
+    ):
+        print(f"--- {path}")
+        before = await measure("legacy", legacy, message, args.iterations)
+        after = await measure("prebuilt", prebuilt, message, args.iterations)
+        print(f"saved {before - after:.1f} us/call ({(1 - after / before) * 100:.0f}%)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Проверка планировщика исходящих запросов на фейковой сессии Bot API.
+
+Всплеск интерактивных ответов в разные чаты идёт одновременно с массовой
+рассылкой; сессия периодически отвечает 429. Печатает фактическую
+скорость отправки, время ожидания по полосам и метрики планировщика.
+
+Запуск: python -m bench.bench_scheduler [--chats N] [--bulk N] [--rate R]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from bench.fake_session import FAKE_TOKEN, FakeSession
+
+os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+
+from aiogram import Bot
+
+from send_scheduler import SendScheduler, bulk_sending, install_send_scheduler
+
+async def send(bot, chat_id, waits):
+    started = time.monotonic()
+    await bot.send_message(chat_id=chat_id, text="hello")
+    waits.append(time.monotonic() - started)
+
+async def send_bulk(bot, chat_id, waits):
+    with bulk_sending():
+        await send(bot, chat_id, waits)
+
+def max_per_window(timestamps, window=1.0):
+    best, left = 0, 0
+    for right, ts in enumerate(timestamps):
+        while ts - timestamps[left] > window:
+            left += 1
+        best = max(best, right - left + 1)
+    return best
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--bulk", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100)
+    parser.add_argument("--flood-every", type=int, default=50)
+    args = parser.parse_args()
+
+    session = FakeSession(latency=0.005, flood_every=args.flood_every, retry_after=1)
+    bot = Bot(token=FAKE_TOKEN, session=session)
+    scheduler = install_send_scheduler(bot, SendScheduler(global_rate=args.rate, global_burst=args.rate))
+
+    interactive_waits, bulk_waits = [], []
+    started = time.monotonic()
+    tasks = [asyncio.create_task(send_bulk(bot, 10_000 + i, bulk_waits)) for i in range(args.bulk)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(send(bot, i, interactive_waits)) for i in range(args.chats)]
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    print(f"sent {len(session.sent_at)} messages in {elapsed:.2f}s, 429 injected: {session.floods}")
+    print(f"max sends in any 1s window: {max_per_window(session.sent_at)} (rate {args.rate:.0f}/s + burst {args.rate:.0f})")
+    for name, waits in (("interactive", interactive_waits), ("bulk", bulk_waits)):
+        print(f"{name:<12} p50 {statistics.median(waits):6.2f}s  max {max(waits):6.2f}s")
+    print(scheduler.stats())
+    await bot.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
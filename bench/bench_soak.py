@@ -0,0 +1,302 @@
+"""Сквозной soak-прогон: настоящий bot.py против локального Bot API.
+
+bot.py запускается отдельным процессом с BOT_API_URL, указывающим на
+FakeBotApi (bench/fake_bot_api.py) на 127.0.0.1. Виртуальные пользователи
+по кругу проходят сценарий bench_load: /start, кнопки меню, мини тест и
+обе ветки поддержки. Каждый шаг ждёт ответа бота в свой чат; время от
+появления обновления в getUpdates до sendMessage — сквозная задержка.
+Между шагами пользователь «думает» случайное время со средним --think.
+
+Задержка распределения считается по логарифмической гистограмме, так что
+память прогона не растёт с его длительностью. Каждые --report-every секунд
+печатается строка за интервал (включая RSS процесса бота — видно утечки),
+в конце — итог: распределение задержек, таймауты, 429, неизвестные методы.
+
+С DATABASE_URL бот работает с настоящей БД — лучше отдельной, тестовой.
+
+Запуск: python -m bench.bench_soak [--users 2000] [--duration 600] [--flood-rate 0.01] [--json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+from collections import Counter
+
+from bench.fake_session import FAKE_TOKEN
+
+os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+# Сценарии шлют сообщения быстрее человека — антифлуд по умолчанию выключен
+os.environ.setdefault("THROTTLE_ENABLED", "0")
+# Общий лимит Telegram (30 сообщений/с) иначе сам стал бы узким местом;
+# ответную реакцию Telegram на нагрузку изображают --flood-rate и --latency
+os.environ.setdefault("SEND_GLOBAL_RATE", "100000")
+os.environ.setdefault("SEND_GLOBAL_BURST", "100000")
+
+from bench.bench_load import FIRST_USER_ID, update_payload, user_script
+from bench.fake_bot_api import FakeBotApi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_START_TIMEOUT = 120
+BOT_STOP_TIMEOUT = 30
+
+class LatencyHistogram:
+    """Гистограмма с логарифмическими корзинами (шаг 5%) от 0.1 мс"""
+
+    BASE = 1e-4
+    GROWTH = 1.05
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        index = max(0, int(math.log(max(seconds, self.BASE) / self.BASE, self.GROWTH)))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попал q-й процентиль"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.BASE * self.GROWTH ** (index + 1), self.max)
+        return self.max
+
+    def share_above(self, seconds):
+        limit = int(math.log(max(seconds, self.BASE) / self.BASE, self.GROWTH))
+        above = sum(count for index, count in self.buckets.items() if index >= limit)
+        return above / self.count if self.count else 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p90_ms": round(self.percentile(90) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "p999_ms": round(self.percentile(99.9) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+class Soak:
+    def __init__(self, api, reply_timeout, think, seed):
+        self.api = api
+        self.reply_timeout = reply_timeout
+        self.think = think
+        self.seed = seed
+        self.waiting = {}  # chat_id -> future первого ответа на текущий шаг
+        self.latency = LatencyHistogram()
+        self.interval = LatencyHistogram()
+        self.steps = 0
+        self.timeouts = 0
+        self.interval_timeouts = 0
+        self.unexpected = 0
+        api.on_message = self.on_message
+
+    def on_message(self, chat_id, params):
+        future = self.waiting.pop(chat_id, None)
+        if future is None or future.done():
+            # Второй ответ на шаг, сообщение администратору или опоздавший ответ
+            self.unexpected += 1
+            return
+        future.set_result(time.perf_counter())
+
+    async def virtual_user(self, index, deadline, ramp):
+        user_id = FIRST_USER_ID + index
+        rng = random.Random(self.seed * 1_000_003 + index)
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(rng.random() * ramp)
+
+        while time.monotonic() < deadline:
+            for kind, data in user_script(user_id, rng):
+                if time.monotonic() >= deadline:
+                    return
+                future = loop.create_future()
+                self.waiting[user_id] = future
+                started = time.perf_counter()
+                self.api.push_update(lambda update_id: update_payload(update_id, user_id, kind, data))
+                try:
+                    replied = await asyncio.wait_for(future, self.reply_timeout)
+                except asyncio.TimeoutError:
+                    self.waiting.pop(user_id, None)
+                    self.timeouts += 1
+                    self.interval_timeouts += 1
+                else:
+                    self.interval.add(replied - started)
+                self.steps += 1
+                if self.think:
+                    pause = rng.expovariate(1 / self.think)
+                    await asyncio.sleep(min(pause, max(0.0, deadline - time.monotonic())))
+
+    def take_interval(self):
+        interval, timeouts = self.interval, self.interval_timeouts
+        self.latency.merge(interval)
+        self.interval = LatencyHistogram()
+        self.interval_timeouts = 0
+        return interval, timeouts
+
+def rss_mb(pid):
+    """RSS процесса по /proc (только Linux); None, если недоступно"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+async def start_bot(url, log_path):
+    env = dict(os.environ, BOT_API_URL=url, BOT_MODE="polling")
+    log = open(log_path, "ab")
+    try:
+        return await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "bot.py"),
+            cwd=ROOT, env=env, stdout=log, stderr=log,
+        )
+    finally:
+        log.close()
+
+async def stop_bot(process):
+    if process.returncode is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(process.wait(), BOT_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+    return process.returncode
+
+async def run(args, progress):
+    api = FakeBotApi(
+        latency=args.latency / 1000, jitter=args.jitter / 1000,
+        flood_rate=args.flood_rate, retry_after=args.retry_after, seed=args.seed,
+    )
+    runner, url = await api.start()
+    process = await start_bot(url, args.bot_log)
+    soak = Soak(api, args.reply_timeout, args.think, args.seed)
+    peak_rss = None
+    try:
+        # Бот готов, когда пришёл первый getUpdates
+        waiter = asyncio.ensure_future(api.polling.wait())
+        exited = asyncio.ensure_future(process.wait())
+        await asyncio.wait({waiter, exited}, timeout=BOT_START_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        if not api.polling.is_set():
+            waiter.cancel()
+            exited.cancel()
+            raise RuntimeError(f"bot.py did not start polling, see {args.bot_log}")
+        exited.cancel()
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        users = asyncio.gather(*(
+            soak.virtual_user(index, deadline, args.ramp) for index in range(args.users)
+        ))
+        while not users.done():
+            await asyncio.wait({users}, timeout=args.report_every)
+            if process.returncode is not None:
+                users.cancel()
+                break
+            if users.done():
+                break
+            interval, timeouts = soak.take_interval()
+            rss = rss_mb(process.pid)
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            progress(time.monotonic() - started, interval, timeouts, api, rss)
+        elapsed = time.monotonic() - started
+        try:
+            await users
+        except asyncio.CancelledError:
+            pass
+    finally:
+        returncode = await stop_bot(process)
+        await runner.cleanup()
+
+    soak.take_interval()
+    sent = api.calls["sendmessage"]
+    steps = soak.steps
+    return {
+        "users": args.users,
+        "seconds": round(elapsed, 1),
+        "steps": steps,
+        "steps_per_sec": round(steps / elapsed, 1) if elapsed else 0.0,
+        "latency": soak.latency.summary(),
+        "over_1s": round(soak.latency.share_above(1.0), 5),
+        "timeouts": soak.timeouts,
+        "timeout_rate": round(soak.timeouts / steps, 5) if steps else 0.0,
+        "send_message_calls": sent,
+        "injected_429": sum(api.floods.values()),
+        "injected_429_rate": round(sum(api.floods.values()) / sent, 5) if sent else 0.0,
+        "unexpected_replies": soak.unexpected,
+        "api_calls": dict(api.calls),
+        "unknown_methods": dict(api.unknown),
+        "bot_peak_rss_mb": peak_rss,
+        "bot_exit_code": returncode,
+    }
+
+def print_interval(elapsed, interval, timeouts, api, rss):
+    summary = interval.summary()
+    memory = f"  RSS {rss} МБ" if rss is not None else ""
+    print(f"[{elapsed:7.0f} с] шагов {summary['count']}, таймаутов {timeouts}, "
+          f"p50 {summary['p50_ms']} p99 {summary['p99_ms']} max {summary['max_ms']} мс, "
+          f"429 всего {sum(api.floods.values())}, в очереди {api.pending_updates}{memory}", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=300, help="секунды")
+    parser.add_argument("--ramp", type=float, default=10, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=2.0, help="средняя пауза между шагами, с")
+    parser.add_argument("--reply-timeout", type=float, default=30, help="с")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля sendMessage с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--report-every", type=float, default=30, help="с")
+    parser.add_argument("--bot-log", default=os.devnull, help="куда писать вывод bot.py")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="итог одной строкой JSON")
+    args = parser.parse_args()
+
+    progress = (lambda *_: None) if args.json else print_interval
+    report = asyncio.run(run(args, progress))
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    latency = report["latency"]
+    print(f"{report['steps']} шагов от {report['users']} пользователей за {report['seconds']} с "
+          f"({report['steps_per_sec']} шагов/с)")
+    print(f"  сквозная задержка, мс: p50 {latency['p50_ms']}  p90 {latency['p90_ms']}  "
+          f"p99 {latency['p99_ms']}  p99.9 {latency['p999_ms']}  max {latency['max_ms']}")
+    print(f"  дольше 1 с: {report['over_1s']:.3%}, таймаутов: {report['timeouts']} ({report['timeout_rate']:.3%})")
+    print(f"  sendMessage: {report['send_message_calls']}, из них 429: {report['injected_429']} "
+          f"({report['injected_429_rate']:.3%}), лишних ответов: {report['unexpected_replies']}")
+    if report["unknown_methods"]:
+        print(f"  неизвестные методы Bot API: {report['unknown_methods']}")
+    if report["bot_peak_rss_mb"] is not None:
+        print(f"  пиковый RSS бота: {report['bot_peak_rss_mb']} МБ")
+    print(f"  код выхода bot.py: {report['bot_exit_code']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Пропускная способность многопроцессного режима: 1 процесс против N.
+
+Обновления раздаются через WorkerPool так же, как в распределителе;
+в процессах вместо Bot API — FakeSession, БД не используется.
+
+Запуск: python -m bench.bench_workers [--updates N] [--users U] [--workers 1 4]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from bench.fake_session import FAKE_TOKEN, FakeSession
+
+os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+# Каждый пользователь получает сотни обновлений подряд; процессы
+# WorkerPool наследуют окружение, так что антифлуд выключен и в них
+os.environ.setdefault("THROTTLE_ENABLED", "0")
+os.environ.pop("DATABASE_URL", None)
+
+from workers import WorkerPool
+
+TEXTS = [
+    "/start",
+    "📚 Узнать о курсе",
+    "👥 Для какого возраста",
+    "📋 Формат занятий",
+    "🎯 Результаты курса",
+    "⏰ Как проходят занятия",
+    "💰 Оплата",
+    "просто текст",
+]
+
+def fake_setup(bot_module):
+    bot_module.bot.session = FakeSession(record=False)
+
+def make_updates(count, users):
+    now = int(time.time())
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = 1000 + update_id % users
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+                "text": TEXTS[update_id % len(TEXTS)],
+            },
+        })
+    return updates
+
+async def run(workers, updates):
+    pool = WorkerPool(workers, setup=fake_setup)
+    pool.start()
+    await pool.wait_ready()
+
+    started = time.perf_counter()
+    for update in updates:
+        await pool.dispatch(update)
+    processed = await pool.stop()
+    elapsed = time.perf_counter() - started
+
+    total = sum(processed.values())
+    print(f"workers={workers:<3} updates={total:<7} {elapsed:7.2f}s {total / elapsed:9.0f} updates/s")
+    return total / elapsed
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.users)
+    print(f"cpu_count={os.cpu_count()}")
+    for workers in args.workers:
+        await run(workers, updates)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Локальный сервер Bot API для сквозных прогонов без сети.
+
+Бот подключается к нему через BOT_API_URL=http://127.0.0.1:PORT — весь
+путь настоящий: long polling getUpdates, сессия aiohttp, разбор JSON,
+sendMessage по HTTP. Поддерживаются getMe, getUpdates, deleteWebhook,
+sendMessage и answerCallbackQuery; остальные методы отвечают 404 и
+попадают в счётчик unknown.
+
+latency и jitter — задержка каждого ответа (кроме getUpdates) в секундах;
+flood_rate — доля sendMessage, на которые приходит 429 с retry_after.
+
+Отдельно, для ручной проверки бота:
+    python -m bench.fake_bot_api --port 8081
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+MAX_UPDATES_LIMIT = 100
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+
+        self._updates = deque()  # неподтверждённые обновления по возрастанию update_id
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self.polling = asyncio.Event()  # бот сделал первый getUpdates
+
+        self.on_message = None  # вызывается как on_message(chat_id, payload) на каждый sendMessage
+        self.calls = Counter()
+        self.floods = Counter()
+        self.unknown = Counter()
+
+    def push_update(self, build):
+        """Новое обновление; build(update_id) возвращает его JSON"""
+        update_id = next(self._update_ids)
+        self._updates.append(build(update_id))
+        self._new_updates.set()
+        return update_id
+
+    @property
+    def pending_updates(self):
+        return len(self._updates)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Запуск на loopback; возвращает (runner, базовый URL)"""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f"http://{host}:{port}"
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+            params.update(request.query)
+        self.calls[method] += 1
+
+        if method == 'getupdates':
+            return ok(await self.get_updates(params))
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._rng.random() * self.jitter)
+
+        if method == 'sendmessage':
+            if self.flood_rate and self._rng.random() < self.flood_rate:
+                self.floods[method] += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                })
+            return ok(self.send_message(params))
+        if method == 'getme':
+            return ok(BOT_USER)
+        if method in ('deletewebhook', 'answercallbackquery'):
+            return ok(True)
+
+        self.unknown[request.match_info['method']] += 1
+        return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"})
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or MAX_UPDATES_LIMIT), MAX_UPDATES_LIMIT)
+        timeout = float(params.get('timeout') or 0)
+        self.polling.set()
+
+        # offset подтверждает всё, что меньше него
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    def send_message(self, params):
+        chat_id = int(params['chat_id'])
+        if self.on_message is not None:
+            self.on_message(chat_id, params)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get('text', ''),
+        }
+
+def ok(result):
+    return web.json_response({"ok": True, "result": result})
+
+async def serve(port, latency, jitter, flood_rate):
+    api = FakeBotApi(latency=latency, jitter=jitter, flood_rate=flood_rate)
+    api.on_message = lambda chat_id, params: print(f"sendMessage {chat_id}: {params.get('text', '')[:60]!r}")
+    runner, url = await api.start(port=port)
+    print(f"BOT_API_URL={url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="секунды")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля sendMessage с ответом 429")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency, args.jitter, args.flood_rate))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import asyncio
+import datetime
+import itertools
+import time
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+from aiogram.types import Chat, Message, User
+
+FAKE_TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: записывает исходящие вызовы.
+
+    Параметры запроса подготавливаются так же, как в настоящей сессии
+    (model_dump + prepare_value), поэтому стоимость сериализации ответа
+    попадает в замеры.
+
+    latency — задержка каждого ответа в секундах; flood_every — каждый
+    N-й sendMessage отвечает 429 с retry_after секундами ожидания.
+    """
+
+    def __init__(self, record=True, latency=0.0, flood_every=0, retry_after=1):
+        super().__init__()
+        self.record = record
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls = []
+        self.sent_at = []
+        self.count = 0
+        self.floods = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and isinstance(method, SendMessage) and (self.count + 1) % self.flood_every == 0:
+            self.count += 1
+            self.floods += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+
+        files = {}
+        payload = {
+            key: self.prepare_value(value, bot=bot, files=files)
+            for key, value in method.model_dump(warnings=False).items()
+        }
+        self.count += 1
+        if self.record:
+            self.calls.append((method.__api_method__, payload))
+            self.sent_at.append(time.monotonic())
+
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=int(payload["chat_id"]), type="private"),
+                text=payload.get("text"),
+            )
+        if isinstance(method, GetMe):
+            return User(id=123456, is_bot=True, first_name="Bench", username="bench_bot")
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
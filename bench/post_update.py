@@ -0,0 +1,44 @@
+"""Отправка синтетических обновлений в локально запущенный webhook.
+
+Запуск:
+    BOT_MODE=webhook WEBHOOK_SECRET=s python bot.py
+    python -m bench.post_update --secret s "/start" "💰 Оплата"
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+_update_ids = itertools.count(int(time.time()))
+
+def make_update(text, user_id=42, first_name="Local"):
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": first_name},
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "text": text,
+        },
+    }
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("texts", nargs="+")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--user-id", type=int, default=42)
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    async with aiohttp.ClientSession() as session:
+        for text in args.texts:
+            async with session.post(args.url, json=make_update(text, args.user_id), headers=headers) as response:
+                print(f"{response.status} {text!r}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,125 +1,165 @@
 import asyncio
 import logging
-import os
+from functools import lru_cache
 from datetime import datetime
-from dotenv import load_dotenv
-import asyncpg
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import BOT_TOKEN, BOT_API_URL, DATABASE_URL, BOT_MODE, FSM_STORAGE, WORKERS, SEND_SCHEDULER, STATS_DAYS, METRICS_ENABLED, DEDUP_ENABLED, THROTTLE_ENABLED, ARCHIVE_AFTER_DAYS
+from db import get_db_connection, create_pool, close_pool, is_connection_error
+from chat_log import chat_log
+from user_cache import user_profiles
+from spool import spool
+from payloads import prebuilt_markup, answer_static
+from pg_storage import PostgresStorage, create_fsm_storage
+from send_scheduler import install_send_scheduler
+from broadcast import Broadcaster
+from support import SupportDesk
+from dedup import UpdateDeduplicator
+from throttle import install_throttler
+from migrations import (
+    LATEST_VERSION,
+    apply_migrations,
+    ensure_chat_partitions,
+    run_partition_maintenance,
+    schema_is_current,
+)
+from rollups import fetch_stats, format_stats, run_rollup_maintenance
+from archive import run_archive_maintenance
+from quiz_engine import QuizEngine, QuizStep
+from quiz_results import fetch_quiz_summary, format_quiz_summary
+from metrics import install_metrics, start_metrics_server
+from test_module import MINI_TEST, log_test_result_to_db, latest_results, latest_level_text
 
-load_dotenv()
-
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-DATABASE_URL = os.getenv('DATABASE_URL')
 CHANNEL_LINK = "ссылка"  # Замените на реальную ссылку на канал
 ELENA_CONTACT = "@Lebedeva_Elen"
 ADMIN_CHAT_ID = 269435099  # chat_id администратора
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
-# Импортируем функции теста
-from test_module import TestStates
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None,
+)
+# Все исходящие запросы идут через планировщик с учётом лимитов Telegram
+send_scheduler = install_send_scheduler(bot) if SEND_SCHEDULER else None
+dp = Dispatcher(storage=create_fsm_storage(FSM_STORAGE))
+broadcaster = Broadcaster(bot)
+support_desk = SupportDesk(bot, ADMIN_CHAT_ID)
+# Повторно доставленные обновления отсекаются раньше всех остальных middleware
+dedup = UpdateDeduplicator() if DEDUP_ENABLED else None
+if dedup is not None:
+    dp.update.outer_middleware(dedup)
+# Антифлуд: сообщения сверх лимита не доходят до БД и хэндлеров
+throttler = install_throttler(dp, exempt=(ADMIN_CHAT_ID,)) if THROTTLE_ENABLED else None
+# Метрики по хэндлерам; при выключенных middleware не подключаются вовсе
+metrics_pool_init = install_metrics(dp, bot) if METRICS_ENABLED else None
+
+# Тесты: описания компилируются один раз при старте
+quizzes = QuizEngine()
+quizzes.register(MINI_TEST)
 
 # Функции для работы с базой данных
-async def get_db_connection():
-    try:
-        return await asyncpg.connect(DATABASE_URL)
-    except Exception as e:
-        logging.error(f"Database connection error: {e}")
-        return None
-
 async def init_database():
-    """Создание таблиц при запуске бота"""
-    conn = await get_db_connection()
-    if not conn:
-        return
+    """Проверка версии схемы; миграции и секции mss_chat — только если схема устарела.
 
+    Без БД бот работает как раньше, но ошибка миграции останавливает
+    запуск: с неполной схемой каждый пакет журнала падал бы и терялся.
+    """
     try:
-        # Создание таблицы пользователей
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS mss_users (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT UNIQUE NOT NULL,
-                username VARCHAR(255),
-                first_name VARCHAR(255),
-                last_name VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Создание таблицы сообщений
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS mss_chat (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                username VARCHAR(255),
-                message_text TEXT,
-                message_type VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        logging.info("Database tables initialized successfully")
+        async with get_db_connection() as conn:
+            if not conn:
+                return
+
+            # Обычный перезапуск: схема уже актуальна, DDL и блокировки не нужны
+            if await schema_is_current(conn):
+                logging.info(f"Database schema is up to date (version {LATEST_VERSION})")
+                return
+
+            await apply_migrations(conn)
+            await ensure_chat_partitions(conn)
+            logging.info("Database tables initialized successfully")
 
     except Exception as e:
-        logging.error(f"Database initialization error: {e}")
-    finally:
-        await conn.close()
+        logging.error(f"Database initialization error: {e!r}")
+        raise
 
 async def add_user_to_db(user: types.User):
-    """Добавление пользователя в БД"""
-    conn = await get_db_connection()
-    if not conn:
+    """Добавление пользователя в БД (upsert только при изменении профиля)"""
+    profile = (user.username, user.first_name, user.last_name)
+    now = datetime.now()
+
+    if user_profiles.is_fresh(user.id, profile):
+        # Профиль не менялся — last_activity уйдёт в общем пакетном UPDATE
+        user_profiles.touch(user.id, now)
         return
 
     try:
-        await conn.execute('''
-            INSERT INTO mss_users (user_id, username, first_name, last_name, last_activity)
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT (user_id)
-            DO UPDATE SET
-                username = EXCLUDED.username,
-                first_name = EXCLUDED.first_name,
-                last_name = EXCLUDED.last_name,
-                last_activity = EXCLUDED.last_activity
-        ''', user.id, user.username, user.first_name, user.last_name, datetime.now())
+        async with get_db_connection() as conn:
+            if not conn:
+                # БД недоступна: профиль допишется из локального журнала
+                spool.append_users([(user.id, user.username, user.first_name, user.last_name, now)])
+                user_profiles.remember(user.id, profile)
+                return
+
+            await conn.execute('''
+                INSERT INTO mss_users (user_id, username, first_name, last_name, last_activity)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    username = EXCLUDED.username,
+                    first_name = EXCLUDED.first_name,
+                    last_name = EXCLUDED.last_name,
+                    last_activity = EXCLUDED.last_activity,
+                    blocked_at = NULL
+            ''', user.id, user.username, user.first_name, user.last_name, now)
+            user_profiles.remember(user.id, profile)
 
     except Exception as e:
         logging.error(f"Error adding user to database: {e}")
-    finally:
-        await conn.close()
+        if is_connection_error(e):
+            spool.append_users([(user.id, user.username, user.first_name, user.last_name, now)])
 
 async def log_message_to_db(user: types.User, message_text: str, message_type: str = "text"):
-    """Логирование сообщения в БД"""
-    conn = await get_db_connection()
-    if not conn:
-        return
-
-    try:
-        await conn.execute('''
-            INSERT INTO mss_chat (user_id, username, message_text, message_type)
-            VALUES ($1, $2, $3, $4)
-        ''', user.id, user.username, message_text, message_type)
-
-    except Exception as e:
-        logging.error(f"Error logging message to database: {e}")
-    finally:
-        await conn.close()
-
+    """Логирование сообщения в БД (запись уходит в пакетный журнал и не ждёт БД)"""
+    await chat_log.log(user.id, user.username, message_text, message_type)
+
+# Разделы главного меню: текст кнопки -> (обработчик раздела, тип сообщения для лога).
+# Порядок регистрации задаёт раскладку клавиатуры, по MENU_ROW_WIDTH кнопок в ряд.
+MENU_SECTIONS = {}
+MENU_ROW_WIDTH = 2
+
+def menu_section(button_text, message_type="menu_button"):
+    """Регистрация раздела главного меню"""
+    def decorator(handler):
+        MENU_SECTIONS[button_text] = (handler, message_type)
+        return handler
+    return decorator
+
+def menu_button_filter(message: Message):
+    """Один поиск по словарю вместо цепочки фильтров на каждую кнопку"""
+    section = MENU_SECTIONS.get(message.text)
+    if section is None:
+        return False
+    return {"section": section}
+
+@lru_cache(maxsize=None)
 def get_main_keyboard():
+    """Главное меню; собирается один раз после регистрации всех разделов"""
+    buttons = [KeyboardButton(text=text) for text in MENU_SECTIONS]
     return ReplyKeyboardMarkup(keyboard=[
-        [KeyboardButton(text="📚 Узнать о курсе"), KeyboardButton(text="👥 Для какого возраста")],
-        [KeyboardButton(text="📋 Формат занятий"), KeyboardButton(text="🎯 Результаты курса")],
-        [KeyboardButton(text="⏰ Как проходят занятия"), KeyboardButton(text="💰 Оплата")],
-        [KeyboardButton(text="🆘 Связаться с поддержкой"), KeyboardButton(text="🧩 Мини тест")]
+        buttons[i:i + MENU_ROW_WIDTH] for i in range(0, len(buttons), MENU_ROW_WIDTH)
     ], resize_keyboard=True)
 
+@lru_cache(maxsize=None)
+def get_main_markup():
+    """Главное меню, заранее сериализованное для answer_static()"""
+    return prebuilt_markup(get_main_keyboard())
+
 def get_support_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🆘 Связаться с поддержкой", callback_data="support")]
@@ -146,12 +186,110 @@ async def start_handler(message: Message):
 
 Если у вас возникнут вопросы, пожалуйста, нажмите на кнопку «Связаться с поддержкой»."""
 
-    await message.answer(welcome_text, reply_markup=get_main_keyboard())
+    await answer_static(message, welcome_text, reply_markup=get_main_markup())
 
-@dp.message(lambda message: message.text == "📚 Узнать о курсе")
-async def handle_about_course(message: Message):
+@dp.message(Command("mylevel"))
+async def my_level_command(message: Message, state: FSMContext):
     await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+    await log_message_to_db(message.from_user, "/mylevel", "command")
+    await handle_my_level(message, state)
+
+# --- Команды администратора ---
+@dp.message(Command("broadcast"), F.from_user.id == ADMIN_CHAT_ID)
+async def broadcast_handler(message: Message, command: CommandObject):
+    if not command.args:
+        await message.answer("Использование: /broadcast текст рассылки")
+        return
+
+    broadcast_id = await broadcaster.create(command.args, message.from_user.id)
+    if broadcast_id is None:
+        await message.answer("⚠️ База данных недоступна, рассылка не создана")
+        return
+
+    broadcaster.start(broadcast_id)
+    await message.answer(f"📣 Рассылка #{broadcast_id} запущена. Статус: /broadcast_status {broadcast_id}")
+
+@dp.message(Command("broadcast_status"), F.from_user.id == ADMIN_CHAT_ID)
+async def broadcast_status_handler(message: Message, command: CommandObject):
+    broadcast_id = int(command.args) if command.args and command.args.isdigit() else None
+    row = await broadcaster.status(broadcast_id)
+    if row is None:
+        await message.answer("Рассылок не найдено")
+        return
+
+    await message.answer(
+        f"📣 Рассылка #{row['id']}: {row['status']}\n"
+        f"✅ Отправлено: {row['sent']}\n"
+        f"🚫 Заблокировали бота: {row['blocked']}\n"
+        f"⚠️ Ошибок: {row['failed']}"
+    )
+
+@dp.message(Command("stats"), F.from_user.id == ADMIN_CHAT_ID)
+async def stats_handler(message: Message):
+    rows = await fetch_stats(STATS_DAYS)
+    if rows is None:
+        await message.answer("⚠️ База данных недоступна")
+        return
+
+    await message.answer(format_stats(rows, STATS_DAYS))
+
+@dp.message(Command("quiz_stats"), F.from_user.id == ADMIN_CHAT_ID)
+async def quiz_stats_handler(message: Message, command: CommandObject):
+    quiz = quizzes.quizzes.get(command.args.strip() if command.args else MINI_TEST.quiz_id)
+    if quiz is None:
+        await message.answer(f"Тесты: {', '.join(quizzes.quizzes)}")
+        return
+
+    summary = await fetch_quiz_summary(quiz.quiz_id, STATS_DAYS)
+    if summary is None:
+        await message.answer("⚠️ База данных недоступна")
+        return
+
+    await message.answer(format_quiz_summary(quiz, *summary, STATS_DAYS))
+
+@dp.message(Command("tickets"), F.from_user.id == ADMIN_CHAT_ID)
+async def tickets_handler(message: Message):
+    rows = await support_desk.open_tickets()
+    if rows is None:
+        await message.answer("⚠️ База данных недоступна")
+        return
+    if not rows:
+        await message.answer("✅ Открытых вопросов нет")
+        return
+
+    lines = [f"🆘 Открытые вопросы ({len(rows)}):", ""]
+    for row in rows:
+        lines.append(f"#{row['id']} {row['created_at'].strftime('%d.%m %H:%M')} {row['user_name']}: {row['question'][:100]}")
+    await message.answer("\n".join(lines))
+
+async def support_reply_filter(message: Message):
+    """Ответ администратора reply'ем на пересланный вопрос"""
+    if message.from_user.id != ADMIN_CHAT_ID or message.reply_to_message is None:
+        return False
+    tickets = await support_desk.find(message.reply_to_message.message_id)
+    if not tickets:
+        return False
+    return {"tickets": tickets}
+
+@dp.message(support_reply_filter)
+async def support_reply_handler(message: Message, tickets):
+    ticket, error = await support_desk.reply(tickets, message)
+    if ticket is None:
+        await message.answer(f"⚠️ {error}")
+    elif error:
+        await message.answer(f"⚠️ Не удалось отправить ответ на вопрос #{ticket.id}: {error}")
+    else:
+        await message.answer(f"✅ Ответ на вопрос #{ticket.id} отправлен")
+
+@dp.message(menu_button_filter)
+async def handle_menu_button(message: Message, state: FSMContext, section):
+    handler, message_type = section
+    await add_user_to_db(message.from_user)
+    await log_message_to_db(message.from_user, message.text, message_type)
+    await handler(message, state)
+
+@menu_section("📚 Узнать о курсе")
+async def handle_about_course(message: Message, state: FSMContext):
     course_text = """📚 Узнать подробнее о курсе "Излагай ясно"
 
 Курс по развитию устной и письменной речи.
@@ -182,12 +320,10 @@ async def handle_about_course(message: Message):
 
 📌 Все продумано для того, чтобы каждый участник мог получить свой результат, а также максимум пользы от общения с ведущим и «сокурсниками»."""
 
-    await message.answer(course_text)
+    await answer_static(message, course_text)
 
-@dp.message(lambda message: message.text == "👥 Для какого возраста")
-async def handle_age_info(message: Message):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+@menu_section("👥 Для какого возраста")
+async def handle_age_info(message: Message, state: FSMContext):
     age_text = """👥 Для какого возраста курс?
 
 Курс «Излагай ясно» для подростков 9-16 лет.
@@ -215,12 +351,10 @@ async def handle_age_info(message: Message):
 • 20 собственных текстов, которые напишет ученик
 • Полезные дополнительные материалы"""
 
-    await message.answer(age_text)
+    await answer_static(message, age_text)
 
-@dp.message(lambda message: message.text == "📋 Формат занятий")
-async def handle_format_info(message: Message):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+@menu_section("📋 Формат занятий")
+async def handle_format_info(message: Message, state: FSMContext):
     format_text = """📋 Какой формат занятий?
 
 24 "живые" групповые встречи онлайн. Запись будет.
@@ -232,12 +366,10 @@ async def handle_format_info(message: Message):
 
 При этом каждый участник получит индивидуальную обратную связь по написанным текстам."""
 
-    await message.answer(format_text)
+    await answer_static(message, format_text)
 
-@dp.message(lambda message: message.text == "🎯 Результаты курса")
-async def handle_results_info(message: Message):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+@menu_section("🎯 Результаты курса")
+async def handle_results_info(message: Message, state: FSMContext):
     results_text = """🎯 Что ребенок будет знать и уметь к концу курса?
 
 «Мне не дано писать сочинение», — так никогда не скажет ученик полностью освоивший все 9 структур курса "Излагай ясно".
@@ -274,12 +406,10 @@ async def handle_results_info(message: Message):
 
 Кроме того, он научится хорошо понимать разницу между типами и стилями речи, практически применять множество элементов структуры и стиля и разнообразные средства художественной выразительности текста."""
 
-    await message.answer(results_text)
+    await answer_static(message, results_text)
 
-@dp.message(lambda message: message.text == "⏰ Как проходят занятия")
-async def handle_schedule_info(message: Message):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+@menu_section("⏰ Как проходят занятия")
+async def handle_schedule_info(message: Message, state: FSMContext):
     schedule_text = """⏰ Как проходят занятия?
 
 👥 до 10 человек в группе
@@ -321,12 +451,10 @@ async def handle_schedule_info(message: Message):
 
 🏰 Уроки развития речи курса "Излагай ясно" в этом году посвящены Средневековью. Совместим словесность и историю."""
 
-    await message.answer(schedule_text)
+    await answer_static(message, schedule_text)
 
-@dp.message(lambda message: message.text == "💰 Оплата")
-async def handle_payment_info(message: Message):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
+@menu_section("💰 Оплата")
+async def handle_payment_info(message: Message, state: FSMContext):
     payment_text = f"""💰 Как оплатить?
 
 💳 Оплата:
@@ -348,20 +476,18 @@ async def handle_payment_info(message: Message):
 
 📞 Если у вас есть вопросы по договору, обратитесь к ведущему курса."""
 
-    await message.answer(payment_text)
+    await answer_static(message, payment_text)
 
 
-@dp.message(lambda message: message.text == "🆘 Связаться с поддержкой")
+@menu_section("🆘 Связаться с поддержкой")
 async def handle_support_button(message: Message, state: FSMContext):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "menu_button")
     support_text = """🆘 Связаться с поддержкой
 
 Опишите кратко ваш вопрос, и мы ответим вам сразу, как только сможем!
 
 Напишите ваш вопрос следующим сообщением:"""
 
-    await message.answer(support_text)
+    await answer_static(message, support_text)
     await state.set_state(SupportStates.waiting_for_question)
 
 @dp.callback_query(lambda c: c.data == "support")
@@ -374,7 +500,7 @@ async def process_support_callback(callback_query: types.CallbackQuery, state: F
 
 Напишите ваш вопрос следующим сообщением:"""
 
-    await callback_query.message.answer(support_text)
+    await answer_static(callback_query.message, support_text)
     await state.set_state(SupportStates.waiting_for_question)
 
 @dp.message(SupportStates.waiting_for_question)
@@ -388,18 +514,8 @@ async def process_support_question(message: Message, state: FSMContext):
     user_info = f"@{message.from_user.username}" if message.from_user.username else f"ID: {message.from_user.id}"
     user_name = message.from_user.full_name
 
-    # Отправляем вопрос Елене
-    support_message = f"""🆘 Новый вопрос от пользователя бота:
-
-👤 От: {user_name} ({user_info})
-📝 Вопрос: {user_question}
-
-Отправлено: {message.date.strftime('%d.%m.%Y %H:%M')}"""
-
-    try:
-        # Отправляем сообщение администратору
-        await bot.send_message(chat_id=ADMIN_CHAT_ID, text=support_message)
-
+    # Сохраняем вопрос и пересылаем его Елене
+    if await support_desk.submit(message):
         confirmation_text = f"""✅ Ваш вопрос получен и отправлен ведущему курса!
 
 📝 Вопрос: {user_question}
@@ -409,9 +525,7 @@ async def process_support_question(message: Message, state: FSMContext):
 ⏰ Елена ответит вам в ближайшее время!
 
 📞 Для срочных вопросов обращайтесь напрямую: {ELENA_CONTACT}"""
-
-    except Exception as e:
-        logging.error(f"Failed to send message to admin: {e}")
+    else:
         confirmation_text = f"""✅ Ваш вопрос получен!
 
 📝 Вопрос: {user_question}
@@ -424,121 +538,26 @@ async def process_support_question(message: Message, state: FSMContext):
     await message.answer(confirmation_text)
     await state.clear()
 
-@dp.message(F.text == "🧩 Мини тест")
+@menu_section("🧩 Мини тест", message_type="test_start")
 async def start_test(message: Message, state: FSMContext):
-    await add_user_to_db(message.from_user)
-    await log_message_to_db(message.from_user, message.text, "test_start")
-
-    await state.clear()
-    await state.set_state(TestStates.question1)
-
-    from test_module import q1_kb
-
-    await message.answer(
-        "🧩 Тест уровня владения письменной речью\n\n"
-        "Этот короткий тест поможет определить ваш текущий уровень и подобрать подходящие материалы курса.\n\n"
-        "Вопрос 1 из 5\n\n"
-        "«Зимой лес кажется спящим, но на самом деле жизнь в нем не замирает».\n\n"
-        "Что здесь самое главное?",
-        reply_markup=q1_kb
-    )
-
-@dp.message(TestStates.question1, F.text.in_(["1️⃣ Зимой лес спит", "2️⃣ Жизнь в лесу продолжается", "3️⃣ Лес красивый"]))
-async def question1_handler(message: Message, state: FSMContext):
-    await state.update_data(q1=message.text)
-    await state.set_state(TestStates.question2)
-
-    from test_module import q2_kb
-    await message.answer(
-        "Вопрос 2 из 5\n\n"
-        "Как вам проще — устно рассказывать или письменно писать?",
-        reply_markup=q2_kb
-    )
-
-@dp.message(TestStates.question2, F.text.in_(["1️⃣ Устно", "2️⃣ Письменно", "3️⃣ Одинаково"]))
-async def question2_handler(message: Message, state: FSMContext):
-    await state.update_data(q2=message.text)
-    await state.set_state(TestStates.question3)
-
-    from test_module import q3_kb
-    await message.answer(
-        "Вопрос 3 из 5\n\n"
-        "Выберите лишнее слово:\nСочинение, Пересказ, Квадрат",
-        reply_markup=q3_kb
-    )
-
-@dp.message(TestStates.question3, F.text.in_(["Сочинение", "Пересказ", "Квадрат"]))
-async def question3_handler(message: Message, state: FSMContext):
-    await state.update_data(q3=message.text)
-    await state.set_state(TestStates.question4)
-
-    from test_module import q4_kb
-    await message.answer(
-        "Вопрос 4 из 5\n\n"
-        "Что труднее всего в сочинении?",
-        reply_markup=q4_kb
-    )
+    await quizzes.start(message, state, MINI_TEST.quiz_id)
 
-@dp.message(TestStates.question4, F.text.in_(["1️⃣ Начать", "2️⃣ Продолжить (основная часть)", "3️⃣ Закончить"]))
-async def question4_handler(message: Message, state: FSMContext):
-    await state.update_data(q4=message.text)
-    await state.set_state(TestStates.question5)
+@menu_section("📊 Мой уровень", message_type="my_level")
+async def handle_my_level(message: Message, state: FSMContext):
+    latest = await latest_results.get(message.from_user.id, MINI_TEST.quiz_id)
+    await message.answer(latest_level_text(MINI_TEST, latest), reply_markup=get_main_keyboard(), parse_mode="Markdown")
 
-    await message.answer(
-        "Вопрос 5 из 5\n\n"
-        "Напишите одним предложением, что вам было интересно на этой неделе ✍️\n\n"
-        "Просто отправьте ваш ответ следующим сообщением:",
-        reply_markup=ReplyKeyboardMarkup(keyboard=[], resize_keyboard=True)
-    )
+@dp.message(quizzes.step_filter)
+async def handle_quiz_answer(message: Message, state: FSMContext, quiz_step: QuizStep):
+    result = await quizzes.answer(message, state, quiz_step)
+    if result is None:
+        return
 
-@dp.message(TestStates.question5)
-async def finish_test(message: Message, state: FSMContext):
     await add_user_to_db(message.from_user)
-
-    await state.update_data(q5=message.text)
-    data = await state.get_data()
-
-    # --- Логика определения уровня ---
-    level = "Новичок"
-    if data["q1"] == "2️⃣ Жизнь в лесу продолжается" and data["q3"] == "Квадрат":
-        if data["q4"] == "3️⃣ Закончить":
-            level = "Продвинутый"
-        else:
-            level = "Уверенный"
-
-    # --- Рекомендации ---
-    if level == "Новичок":
-        rec = ("🌱 Вы умеете рассказывать устно, но письменно пока трудно начать. "
-               "На курсе мы будем шаг за шагом тренировать, как превращать мысли в текст.\n\n"
-               "💡 Совет до курса: ✍️ Записывайте каждый день одно предложение о своём дне.")
-        emoji = "🌱"
-    elif level == "Уверенный":
-        rec = ("🌿 У вас уже получается писать, но иногда путаетесь в структуре. "
-               "Мы научимся быстро видеть план текста и строить вступление и заключение.\n\n"
-               "💡 Совет до курса: 📝 попробуйте к любому тексту составить план из 3 ключевых слов.")
-        emoji = "🌿"
-    else:
-        rec = ("🌳 Вы легко выражаете мысли, теперь важно сделать их красивыми и выразительными. "
-               "На курсе мы освоим стилистические техники и «украшения текста».\n\n"
-               "💡 Совет до курса: 🎨 попробуйте использовать метафору или сравнение в каждом новом тексте.")
-        emoji = "🌳"
-
     # Логируем результаты теста
-    from test_module import log_test_result_to_db
-    await log_test_result_to_db(message.from_user, data, level)
-
-    result_text = f"""🎉 Тест завершён!
-
-{emoji} Ваш уровень: **{level}**
-
-{rec}
-
-📚 Курс "Излагай ясно" поможет вам развить навыки письменной речи независимо от текущего уровня!
-
-Хотите узнать больше о курсе? Выберите интересующий раздел в меню."""
+    await log_test_result_to_db(message.from_user, result)
 
-    await message.answer(result_text, reply_markup=get_main_keyboard(), parse_mode="Markdown")
-    await state.clear()
+    await message.answer(result.text(), reply_markup=get_main_keyboard(), parse_mode="Markdown")
 
 @dp.message()
 async def handle_other_messages(message: Message):
@@ -548,15 +567,109 @@ async def handle_other_messages(message: Message):
     await log_message_to_db(message.from_user, message.text, "other_message")
 
     help_text = f"""❓ Используйте меню для навигации по боту или обратитесь за помощью к ведущему курса: {ELENA_CONTACT}"""
-    await message.answer(help_text, reply_markup=get_main_keyboard())
+    await answer_static(message, help_text, reply_markup=get_main_markup())
+
+# Фоновые задачи, запущенные после прогрева БД: необязательные подсистемы и обслуживание
+background_tasks = []
+
+async def warm_up_database():
+    """Пул соединений, проверка схемы и фоновые писатели в БД.
+
+    Необязательные подсистемы запускаются в конце в фоне — обновления
+    принимаются, не дожидаясь их.
+    """
+    await create_pool(init=metrics_pool_init)
+    await init_database()
+
+    if DATABASE_URL:
+        spool.open()
+        spool.start()
+    chat_log.start()
+    user_profiles.start()
+    if isinstance(dp.storage, PostgresStorage):
+        dp.storage.start()
+    if dedup is not None:
+        # Очистка mss_processed_updates нужна в любом режиме, offset — только при polling
+        dedup.start()
+
+    background_tasks.extend([
+        asyncio.create_task(start_optional_subsystems(), name="optional subsystems"),
+        asyncio.create_task(run_partition_maintenance(), name="partition maintenance"),
+        asyncio.create_task(run_rollup_maintenance(), name="rollup maintenance"),
+    ])
+    if ARCHIVE_AFTER_DAYS > 0:
+        background_tasks.append(asyncio.create_task(run_archive_maintenance(), name="archive maintenance"))
+    for task in background_tasks:
+        task.add_done_callback(log_task_failure)
+
+def log_task_failure(task):
+    """Ошибка фоновой задачи — в лог сразу, а не молча при остановке"""
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background task '{task.get_name()}' failed: {task.exception()!r}")
+
+async def start_optional_subsystems():
+    """То, без чего можно отвечать пользователям; возвращает runner метрик"""
+    results = await asyncio.gather(broadcaster.resume(), support_desk.load_open(), return_exceptions=True)
+    for name, result in zip(("broadcast resume", "support tickets load"), results):
+        if isinstance(result, Exception):
+            logging.error(f"Optional subsystem '{name}' failed: {result!r}")
+    return await start_metrics_server() if METRICS_ENABLED else None
+
+async def prepare_polling():
+    # Запросы к Bot API уходят первыми: пока ждём ответа, готовится БД
+    await asyncio.gather(bot.delete_webhook(), bot.me(), warm_up_database())
+    if dedup is not None:
+        last_update_id = await dedup.load_offset(bot.id)
+        if last_update_id is not None:
+            # Подтверждаем Telegram всё, что уже обработано до перезапуска
+            await bot.get_updates(offset=last_update_id + 1, timeout=0, limit=1)
+        dedup.start(bot.id)
+
+async def stop_background_tasks():
+    metrics_runner = None
+    for task in background_tasks:
+        if task.done() and not task.cancelled() and task.exception() is None:
+            metrics_runner = metrics_runner or task.result()
+        else:
+            task.cancel()
+    background_tasks.clear()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
 
 async def main():
     logging.basicConfig(level=logging.INFO)
 
-    # Инициализация базы данных при запуске
-    await init_database()
+    if WORKERS > 1:
+        # Схема готовится один раз; дальше с БД работают только процессы-обработчики
+        await create_pool()
+        await init_database()
+        await close_pool()
+        from workers import run_supervisor
+        await run_supervisor(bot, dp, WORKERS)
+        return
 
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == 'webhook':
+            from webhook import run_webhook
+            try:
+                await run_webhook(dp, bot, warm_up=warm_up_database())
+            finally:
+                await bot.session.close()
+        else:
+            await prepare_polling()
+            await dp.start_polling(bot)
+    finally:
+        # Дописываем накопленный журнал до закрытия пула
+        await stop_background_tasks()
+        if dedup is not None:
+            await dedup.stop()
+        await broadcaster.stop()
+        await support_desk.stop()
+        await chat_log.stop()
+        await user_profiles.stop()
+        await spool.stop()
+        await dp.storage.close()
+        await close_pool()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
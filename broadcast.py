@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from config import BROADCAST_CHUNK_SIZE, BROADCAST_CONCURRENCY
+from db import get_db_connection
+from send_scheduler import bulk_sending
+
+# Пространство ключей pg_advisory_lock для рассылок
+BROADCAST_LOCK_SPACE = 7301
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям mss_users с возобновлением.
+
+    Получатели читаются по возрастанию user_id порциями по chunk_size
+    (keyset-пагинация: без OFFSET и без долгой транзакции на всё время
+    рассылки). После каждой порции в одной транзакции записываются статусы
+    получателей и контрольная точка last_user_id, так что после падения
+    рассылка продолжается с места остановки; повторно может уйти только
+    порция, которая отправлялась в момент падения.
+
+    Пользователи, заблокировавшие бота, помечаются в mss_users.blocked_at
+    и в следующие рассылки не попадают. Одну рассылку выполняет один
+    процесс — это гарантирует advisory lock на её id.
+    """
+
+    def __init__(self, bot, chunk_size=BROADCAST_CHUNK_SIZE, concurrency=BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._tasks = {}
+
+    async def create(self, text, created_by):
+        """Новая рассылка; возвращает её id"""
+        async with get_db_connection() as conn:
+            if not conn:
+                return None
+            return await conn.fetchval('''
+                INSERT INTO mss_broadcasts (text, created_by) VALUES ($1, $2) RETURNING id
+            ''', text, created_by)
+
+    def start(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self.run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self):
+        """Продолжение рассылок, прерванных перезапуском"""
+        async with get_db_connection() as conn:
+            if not conn:
+                return
+            rows = await conn.fetch("SELECT id FROM mss_broadcasts WHERE status = 'running' ORDER BY id")
+
+        for row in rows:
+            self.start(row['id'])
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def status(self, broadcast_id=None):
+        async with get_db_connection() as conn:
+            if not conn:
+                return None
+            if broadcast_id is None:
+                return await conn.fetchrow('SELECT * FROM mss_broadcasts ORDER BY id DESC LIMIT 1')
+            return await conn.fetchrow('SELECT * FROM mss_broadcasts WHERE id = $1', broadcast_id)
+
+    async def run(self, broadcast_id):
+        async with get_db_connection() as lock_conn:
+            if not lock_conn:
+                logging.error(f"Broadcast {broadcast_id}: database unavailable")
+                return
+
+            locked = await lock_conn.fetchval(
+                'SELECT pg_try_advisory_lock($1, $2)', BROADCAST_LOCK_SPACE, broadcast_id
+            )
+            if not locked:
+                logging.info(f"Broadcast {broadcast_id} is already running in another process")
+                return
+
+            try:
+                await self._run_locked(lock_conn, broadcast_id)
+            except asyncio.CancelledError:
+                logging.info(f"Broadcast {broadcast_id} paused, will resume from the checkpoint")
+                raise
+            except Exception as e:
+                logging.error(f"Broadcast {broadcast_id} failed: {e}")
+            finally:
+                await lock_conn.execute(
+                    'SELECT pg_advisory_unlock($1, $2)', BROADCAST_LOCK_SPACE, broadcast_id
+                )
+
+    async def _run_locked(self, conn, broadcast_id):
+        broadcast = await conn.fetchrow('''
+            SELECT text, status, last_user_id FROM mss_broadcasts WHERE id = $1
+        ''', broadcast_id)
+        if broadcast is None or broadcast['status'] != 'running':
+            return
+
+        text, last_user_id = broadcast['text'], broadcast['last_user_id']
+        logging.info(f"Broadcast {broadcast_id}: starting after user_id {last_user_id}")
+
+        while True:
+            rows = await conn.fetch('''
+                SELECT u.user_id FROM mss_users u
+                WHERE u.user_id > $1 AND u.blocked_at IS NULL
+                ORDER BY u.user_id
+                LIMIT $2
+            ''', last_user_id, self.chunk_size)
+            if not rows:
+                break
+
+            user_ids = [row['user_id'] for row in rows]
+            results = await self._send_chunk(text, user_ids)
+            last_user_id = user_ids[-1]
+            await self._save_chunk(conn, broadcast_id, last_user_id, results)
+
+        await conn.execute('''
+            UPDATE mss_broadcasts SET status = 'done', finished_at = $2 WHERE id = $1
+        ''', broadcast_id, datetime.now())
+        logging.info(f"Broadcast {broadcast_id}: done")
+
+    async def _send_chunk(self, text, user_ids):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id):
+            async with semaphore:
+                try:
+                    await self.bot.send_message(chat_id=user_id, text=text)
+                    return user_id, 'sent', None
+                except TelegramForbiddenError as e:
+                    return user_id, 'blocked', str(e)
+                except TelegramBadRequest as e:
+                    # Например, «chat not found» — писать этому пользователю тоже некуда
+                    return user_id, 'blocked', str(e)
+                except Exception as e:
+                    return user_id, 'failed', str(e)
+
+        with bulk_sending():
+            return await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+    async def _save_chunk(self, conn, broadcast_id, last_user_id, results):
+        now = datetime.now()
+        user_ids = [user_id for user_id, _, _ in results]
+        statuses = [status for _, status, _ in results]
+        errors = [error for _, _, error in results]
+        blocked = [user_id for user_id, status, _ in results if status == 'blocked']
+
+        async with conn.transaction():
+            await conn.execute('''
+                INSERT INTO mss_broadcast_recipients (broadcast_id, user_id, status, error, sent_at)
+                SELECT $1, r.user_id, r.status, r.error, $5
+                FROM unnest($2::bigint[], $3::varchar[], $4::text[]) AS r(user_id, status, error)
+                ON CONFLICT (broadcast_id, user_id) DO NOTHING
+            ''', broadcast_id, user_ids, statuses, errors, now)
+
+            if blocked:
+                await conn.execute('''
+                    UPDATE mss_users SET blocked_at = $2 WHERE user_id = ANY($1::bigint[])
+                ''', blocked, now)
+
+            await conn.execute('''
+                UPDATE mss_broadcasts SET
+                    last_user_id = $2,
+                    sent = sent + $3,
+                    blocked = blocked + $4,
+                    failed = failed + $5
+                WHERE id = $1
+            ''', broadcast_id, last_user_id, statuses.count('sent'), len(blocked), statuses.count('failed'))
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from config import (
+    CHAT_LOG_BATCH_SIZE,
+    CHAT_LOG_FLUSH_MS,
+    CHAT_LOG_QUEUE_SIZE,
+    CHAT_LOG_OVERFLOW,
+    CHAT_LOG_PUT_TIMEOUT,
+)
+from db import get_db_connection, is_connection_error
+from rollups import add_to_rollups
+from quiz_results import QUIZ_RESULT_COLUMNS
+from spool import spool
+
+CHAT_COLUMNS = ('user_id', 'username', 'message_text', 'message_type', 'created_at')
+
+class ChatLogWriter:
+    """Отложенная пакетная запись журнала сообщений в mss_chat.
+
+    Хэндлеры кладут записи в ограниченную очередь и сразу возвращаются,
+    фоновая задача сбрасывает их в БД через COPY, как только набирается
+    batch_size записей или проходит flush_ms миллисекунд. В той же
+    транзакции пакет учитывается в дневных сводках (rollups.py), а
+    результаты тестов пишутся в quiz_results. Пока БД недоступна, пакеты
+    уходят в локальный журнал (spool.py) и дописываются позже.
+    Пакет, отвергнутый БД не из-за соединения, пишется по одной строке,
+    чтобы ошибочная запись не потеряла записи остальных пользователей.
+
+    При переполнении очереди (overflow):
+    - "block" — хэндлер ждёт освобождения места не дольше put_timeout секунд,
+      после чего запись отбрасывается;
+    - "drop" — запись отбрасывается сразу.
+    """
+
+    def __init__(self, batch_size=CHAT_LOG_BATCH_SIZE, flush_ms=CHAT_LOG_FLUSH_MS,
+                 queue_size=CHAT_LOG_QUEUE_SIZE, overflow=CHAT_LOG_OVERFLOW,
+                 put_timeout=CHAT_LOG_PUT_TIMEOUT):
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"Unknown chat log overflow policy: {overflow}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.dropped = 0
+
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._batch = []
+        self._task = None
+        self._writing = False
+        self._closing = False
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + len(self._batch)
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи и запись всего, что осталось в очереди"""
+        self._closing = True
+        if self._task is not None:
+            if not self._writing:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        for i in range(0, len(batch), self.batch_size):
+            await self._write(batch[i:i + self.batch_size])
+
+    async def log(self, user_id, username, message_text, message_type, quiz_result=None):
+        """Постановка записи в очередь; False, если запись отброшена.
+
+        quiz_result — строка quiz_results без created_at (quiz_result_row()),
+        записывается в одной транзакции с самой записью журнала.
+        """
+        record = (user_id, username, message_text, message_type, datetime.now())
+        if quiz_result is not None:
+            record += (quiz_result,)
+
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow == 'block' and self.put_timeout > 0:
+            try:
+                await asyncio.wait_for(self._queue.put(record), self.put_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning(f"Chat log queue is full, dropped {self.dropped} records")
+        return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._closing:
+                self._batch.append(await self._queue.get())
+                deadline = loop.time() + self.flush_interval
+
+                while len(self._batch) < self.batch_size:
+                    if not self._queue.empty():
+                        self._batch.append(self._queue.get_nowait())
+                        continue
+
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                batch, self._batch = self._batch, []
+                self._writing = True
+                try:
+                    await self._write(batch)
+                finally:
+                    self._writing = False
+        except asyncio.CancelledError:
+            pass
+
+    async def _write(self, batch):
+        if not batch:
+            return
+
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    spool.append_chat(batch)
+                    return
+
+                async with conn.transaction():
+                    await write_chat_batch(conn, batch)
+        except Exception as e:
+            logging.error(f"Error writing chat log batch to database: {e}")
+            if is_connection_error(e):
+                spool.append_chat(batch)
+            elif len(batch) > 1:
+                await self._write_rows(batch)
+
+    async def _write_rows(self, batch):
+        """Запись по одной строке после ошибки пакета: плохая строка не теряет остальные"""
+        done = 0
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    spool.append_chat(batch)
+                    return
+
+                for record in batch:
+                    try:
+                        async with conn.transaction():
+                            await write_chat_batch(conn, [record])
+                    except Exception as e:
+                        if is_connection_error(e):
+                            raise
+                        logging.error(f"Chat log: dropped {record[3]} record of user {record[0]}: {e}")
+                    done += 1
+        except Exception as e:
+            logging.error(f"Error writing chat log records to database: {e}")
+            if is_connection_error(e):
+                spool.append_chat(batch[done:])
+
+async def write_chat_batch(conn, batch):
+    """Запись пакета в mss_chat, quiz_results и сводки; вызывается в транзакции"""
+    chat_records = [record[:5] for record in batch]
+    quiz_records = [tuple(record[5]) + (record[4],) for record in batch if len(record) > 5]
+
+    await conn.copy_records_to_table('mss_chat', records=chat_records, columns=CHAT_COLUMNS)
+    if quiz_records:
+        await conn.copy_records_to_table('quiz_results', records=quiz_records, columns=QUIZ_RESULT_COLUMNS)
+    await add_to_rollups(conn, chat_records)
+
+# Общий журнал процесса
+chat_log = ChatLogWriter()
@@ -0,0 +1,128 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Свой сервер Bot API (локальный telegram-bot-api или bench/fake_bot_api.py); по умолчанию api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL')
+
+# Пул соединений с БД
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', '5'))  # секунды
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '10'))  # секунды
+# Миграции переносят и пересчитывают весь журнал — у них свой, длинный таймаут
+DB_MIGRATION_TIMEOUT = float(os.getenv('DB_MIGRATION_TIMEOUT', '3600'))  # секунды
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+# Автомат отключения БД: после стольких ошибок соединения подряд запросы не ждут БД
+DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', '3'))
+DB_BREAKER_RESET_SEC = float(os.getenv('DB_BREAKER_RESET_SEC', '10'))
+
+# Локальный журнал записей на время недоступности БД
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'spool')
+SPOOL_FSYNC_MS = int(os.getenv('SPOOL_FSYNC_MS', '200'))
+SPOOL_REPLAY_SEC = float(os.getenv('SPOOL_REPLAY_SEC', '5'))
+SPOOL_REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', '5000'))
+
+# Пакетная запись журнала mss_chat
+CHAT_LOG_BATCH_SIZE = int(os.getenv('CHAT_LOG_BATCH_SIZE', '200'))
+CHAT_LOG_FLUSH_MS = int(os.getenv('CHAT_LOG_FLUSH_MS', '500'))
+CHAT_LOG_QUEUE_SIZE = int(os.getenv('CHAT_LOG_QUEUE_SIZE', '10000'))
+CHAT_LOG_OVERFLOW = os.getenv('CHAT_LOG_OVERFLOW', 'block')  # block | drop
+CHAT_LOG_PUT_TIMEOUT = float(os.getenv('CHAT_LOG_PUT_TIMEOUT', '0.05'))  # секунды
+
+# Кэш профилей пользователей и отложенное обновление last_activity
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '50000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '3600'))  # секунды
+USER_ACTIVITY_FLUSH_SEC = float(os.getenv('USER_ACTIVITY_FLUSH_SEC', '30'))
+
+# Кэш последних результатов теста для /mylevel (число пользователей)
+QUIZ_RESULT_CACHE_SIZE = int(os.getenv('QUIZ_RESULT_CACHE_SIZE', '50000'))
+# Срок жизни записи: при нескольких репликах (webhook) другой процесс мог записать новый результат
+QUIZ_RESULT_CACHE_TTL = float(os.getenv('QUIZ_RESULT_CACHE_TTL', '300'))  # секунды
+
+# Режим получения обновлений: polling | webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Webhook: публичный адрес сервиса (на Render задаётся RENDER_EXTERNAL_URL)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '25'))  # секунды
+
+# Хранилище FSM: memory | postgres
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '60'))  # секунды
+FSM_STATE_TTL = float(os.getenv('FSM_STATE_TTL', str(7 * 24 * 3600)))  # секунды
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', '600'))  # секунды
+FSM_SWEEP_BATCH = int(os.getenv('FSM_SWEEP_BATCH', '1000'))
+
+# Многопроцессный режим: число процессов-обработчиков (0 или 1 — один процесс)
+WORKERS = int(os.getenv('WORKERS', '0'))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '1000'))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '100'))
+WORKER_STOP_TIMEOUT = float(os.getenv('WORKER_STOP_TIMEOUT', '25'))  # секунды
+WORKER_START_TIMEOUT = float(os.getenv('WORKER_START_TIMEOUT', '120'))  # секунды
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))  # секунды
+
+# Планировщик исходящих запросов (лимиты Telegram)
+SEND_SCHEDULER = os.getenv('SEND_SCHEDULER', '1') == '1'
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))  # сообщений в секунду на бота
+SEND_GLOBAL_BURST = float(os.getenv('SEND_GLOBAL_BURST', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))  # сообщений в секунду в личный чат
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))  # в группу
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+SEND_CHAT_BUCKETS = int(os.getenv('SEND_CHAT_BUCKETS', '10000'))
+
+# Рассылки по mss_users
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '500'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+
+# Помесячные секции mss_chat: сколько месяцев создавать заранее
+CHAT_PARTITIONS_AHEAD = int(os.getenv('CHAT_PARTITIONS_AHEAD', '3'))
+CHAT_PARTITIONS_CHECK_SEC = float(os.getenv('CHAT_PARTITIONS_CHECK_SEC', str(24 * 3600)))
+
+# Сводки по журналу: сколько дней хранить списки пользователей для подсчёта уникальных
+ROLLUP_USERS_KEEP_DAYS = int(os.getenv('ROLLUP_USERS_KEEP_DAYS', '3'))
+STATS_DAYS = int(os.getenv('STATS_DAYS', '7'))
+
+# Метрики обработчиков: Prometheus на локальном порту и трассировка медленных обновлений
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+SLOW_UPDATE_MS = float(os.getenv('SLOW_UPDATE_MS', '1000'))
+
+# Поддержка: окно сводки вопросов при всплесках (0 — каждый вопрос отдельным сообщением)
+SUPPORT_DIGEST_SEC = float(os.getenv('SUPPORT_DIGEST_SEC', '0'))
+SUPPORT_MAP_SIZE = int(os.getenv('SUPPORT_MAP_SIZE', '10000'))
+
+# Защита от повторной обработки обновлений после перезапуска
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', '1') == '1'
+DEDUP_RING_SIZE = int(os.getenv('DEDUP_RING_SIZE', '10000'))
+DEDUP_TABLE_KEEP = int(os.getenv('DEDUP_TABLE_KEEP', '100000'))
+DEDUP_FLUSH_SEC = float(os.getenv('DEDUP_FLUSH_SEC', '5'))
+
+# Антифлуд: GCRA на пользователя (rate сообщений в секунду, пачка до burst)
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', '1') == '1'
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+THROTTLE_MODE = os.getenv('THROTTLE_MODE', 'warn')  # drop | coalesce | warn
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', '100000'))
+
+# Архивация старых строк mss_chat в сжатые файлы (0 — фоновая архивация выключена)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_FORMAT = os.getenv('ARCHIVE_FORMAT', 'ndjson')  # ndjson | csv
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'gzip')  # gzip | zstd
+ARCHIVE_CHUNK_HOURS = int(os.getenv('ARCHIVE_CHUNK_HOURS', '24'))
+ARCHIVE_INTERVAL_SEC = float(os.getenv('ARCHIVE_INTERVAL_SEC', str(24 * 3600)))
+# Диапазонов за один фоновый запуск; бэкфилл истории — через python archive.py run
+ARCHIVE_MAX_CHUNKS = int(os.getenv('ARCHIVE_MAX_CHUNKS', '7'))
+# Предел на COPY и DELETE одного диапазона (таймаут пула бота для них слишком мал)
+ARCHIVE_TIMEOUT = float(os.getenv('ARCHIVE_TIMEOUT', '3600'))  # секунды
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from config import (
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_ACQUIRE_TIMEOUT,
+    DB_COMMAND_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_BREAKER_FAILURES,
+    DB_BREAKER_RESET_SEC,
+)
+
+# Общий пул соединений процесса (создаётся в main())
+pool = None
+# Получает время ожидания соединения из пула (метрики); None — не замеряется
+acquire_observer = None
+# init последнего create_pool(), чтобы пересоздать пул тем же вызовом
+pool_init = None
+
+def is_connection_error(error):
+    """Ошибка говорит о недоступности БД, а не о неверном запросе"""
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    # asyncpg уже загружен: до ошибки запроса был create_pool()
+    import asyncpg
+    return isinstance(error, (
+        asyncpg.exceptions.PostgresConnectionError,
+        asyncpg.exceptions.InterfaceError,
+        asyncpg.exceptions.CannotConnectNowError,
+        asyncpg.exceptions.TooManyConnectionsError,
+    ))
+
+class CircuitBreaker:
+    """Автомат отключения БД.
+
+    После failure_threshold ошибок соединения подряд цепь размыкается:
+    get_db_connection() сразу отдаёт None, и хэндлеры не ждут таймаутов.
+    Через reset_timeout секунд одному вызову разрешается пробное
+    подключение; удачное замыкает цепь, неудачное снова её размыкает.
+    Ошибка запроса (SQL, нарушение ограничения) — тоже ответ сервера и
+    считается успехом.
+    """
+
+    def __init__(self, failure_threshold=DB_BREAKER_FAILURES, reset_timeout=DB_BREAKER_RESET_SEC):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.probing = True
+        return True
+
+    def success(self):
+        if self.opened_at is not None:
+            logging.info("Database circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.probing = False
+        self.failures += 1
+        if self.opened_at is not None:
+            self.opened_at = time.monotonic()
+        elif self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logging.error(f"Database circuit opened after {self.failures} connection errors")
+
+    def record_error(self, error):
+        """Учёт ошибки запроса; True, если это ошибка соединения"""
+        if is_connection_error(error):
+            self.failure()
+            return True
+        self.success()
+        return False
+
+breaker = CircuitBreaker()
+
+async def create_pool(init=None, command_timeout=DB_COMMAND_TIMEOUT):
+    """Создание общего пула соединений с БД.
+
+    init — корутина, вызываемая для каждого нового соединения пула
+    (например, чтобы подключить add_query_logger в замерах).
+    command_timeout — таймаут запроса по умолчанию; None — без таймаута
+    (утилиты выгрузки, которые работают дольше любого запроса бота).
+    """
+    global pool, pool_init
+    pool_init = init
+    if pool is not None:
+        return pool
+    if not DATABASE_URL:
+        logging.warning("DATABASE_URL is not set, working without database")
+        return None
+
+    # asyncpg импортируется здесь, а не при запуске: при холодном старте
+    # это время перекрывается запросами к Bot API
+    import asyncpg
+
+    try:
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            command_timeout=command_timeout,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            init=init,
+        )
+        logging.info(f"Database pool created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    except Exception as e:
+        logging.error(f"Database pool creation error: {e}")
+        pool = None
+    return pool
+
+async def close_pool():
+    """Закрытие пула при остановке бота"""
+    global pool
+    if pool is None:
+        return
+
+    try:
+        await pool.close()
+        logging.info("Database pool closed")
+    except Exception as e:
+        logging.error(f"Database pool close error: {e}")
+    finally:
+        pool = None
+
+@asynccontextmanager
+async def get_db_connection():
+    """Соединение из общего пула; None, если БД недоступна или цепь разомкнута.
+
+    Ошибка внутри блока учитывается автоматом отключения, поэтому
+    перехватывать её нужно снаружи async with, а не внутри.
+    """
+    if pool is None or not breaker.allow():
+        yield None
+        return
+
+    # Пробный вызов держит слот пробы только до первого ответа сервера,
+    # а не до конца блока: блок может быть рассылкой или разбором спула
+    probe = breaker.probing
+    try:
+        conn = await _acquire(probe)
+    except Exception as e:
+        logging.error(f"Database connection error: {e}")
+        breaker.failure()
+        conn = None
+    finally:
+        if probe and breaker.probing:
+            # Проба отменена — цепь остаётся разомкнутой, пробует следующий
+            breaker.probing = False
+    if conn is None:
+        yield None
+        return
+
+    # Успехом считается только выполненная работа: при медленной БД
+    # соединение из пула выдаётся сразу, а запросы падают по таймауту
+    try:
+        yield conn
+    except Exception as e:
+        breaker.record_error(e)
+        raise
+    else:
+        breaker.success()
+    finally:
+        await pool.release(conn)
+
+async def _acquire(probe):
+    """Соединение из пула; для пробного вызова — с проверочным запросом"""
+    if acquire_observer is None:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    else:
+        started = time.perf_counter()
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+        acquire_observer(time.perf_counter() - started)
+
+    if probe:
+        try:
+            await conn.execute('SELECT 1')
+        except BaseException:
+            await pool.release(conn)
+            raise
+        breaker.success()
+    return conn
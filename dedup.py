@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from collections import deque
+
+from aiogram import BaseMiddleware
+
+from config import DEDUP_RING_SIZE, DEDUP_TABLE_KEEP, DEDUP_FLUSH_SEC
+from db import get_db_connection
+
+class UpdateDeduplicator(BaseMiddleware):
+    """Обработка каждого update_id не более одного раза.
+
+    Внешний middleware диспетчера: до любого хэндлера update_id
+    проверяется в кольце последних ring_size id и «захватывается» вставкой
+    в mss_processed_updates. Повтор (перезапуск при polling, повторная
+    доставка webhook другой реплике) пропускается целиком, поэтому
+    записи в БД и сообщения администратору не дублируются. Если обработка
+    упала после захвата, обновление не повторяется — at most once.
+
+    Раз в flush_interval из mss_processed_updates удаляются id старше
+    table_keep от наибольшего захваченного этим процессом — в любом
+    режиме: polling, webhook, несколько процессов. В режиме polling там же
+    последний обработанный update_id сохраняется в mss_bot_offsets; при
+    старте по нему подтверждаются уже обработанные обновления.
+    """
+
+    def __init__(self, ring_size=DEDUP_RING_SIZE, table_keep=DEDUP_TABLE_KEEP, flush_interval=DEDUP_FLUSH_SEC):
+        self.ring_size = ring_size
+        self.table_keep = table_keep
+        self.flush_interval = flush_interval
+        self.last_update_id = None
+        self.skipped = 0
+
+        self._ring = deque()
+        self._seen = set()
+        self._saved_update_id = None
+        self._bot_id = None  # задан только в режиме polling: сохранять offset
+        self._max_claimed = {}  # bot_id -> наибольший захваченный update_id
+        self._pruned_below = {}  # bot_id -> граница последней очистки
+        self._task = None
+
+    def _remember(self, update_id):
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+        if len(self._ring) > self.ring_size:
+            self._seen.discard(self._ring.popleft())
+
+    async def claim(self, bot_id, update_id):
+        """True, если обновление ещё не обрабатывалось"""
+        if update_id in self._seen:
+            return False
+        self._remember(update_id)
+
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    # БД недоступна — защищает только кольцо в памяти
+                    return True
+                claimed = bool(await conn.fetchval('''
+                    INSERT INTO mss_processed_updates (bot_id, update_id)
+                    VALUES ($1, $2)
+                    ON CONFLICT DO NOTHING
+                    RETURNING true
+                ''', bot_id, update_id))
+            if claimed and update_id > self._max_claimed.get(bot_id, 0):
+                self._max_claimed[bot_id] = update_id
+            return claimed
+        except Exception as e:
+            logging.error(f"Error claiming update {update_id}: {e}")
+            return True
+
+    async def __call__(self, handler, event, data):
+        update_id = event.update_id
+        if not await self.claim(data['bot'].id, update_id):
+            self.skipped += 1
+            logging.info(f"Skipping already processed update {update_id}")
+            return None
+
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        return await handler(event, data)
+
+    async def load_offset(self, bot_id):
+        """Последний сохранённый update_id бота или None"""
+        async with get_db_connection() as conn:
+            if not conn:
+                return None
+            update_id = await conn.fetchval('SELECT update_id FROM mss_bot_offsets WHERE bot_id = $1', bot_id)
+        self._saved_update_id = update_id
+        return update_id
+
+    async def save_offset(self):
+        if self._bot_id is None or self.last_update_id is None or self.last_update_id == self._saved_update_id:
+            return
+
+        update_id = self.last_update_id
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    return
+                await conn.execute('''
+                    INSERT INTO mss_bot_offsets (bot_id, update_id, updated_at)
+                    VALUES ($1, $2, CURRENT_TIMESTAMP)
+                    ON CONFLICT (bot_id) DO UPDATE SET
+                        update_id = GREATEST(mss_bot_offsets.update_id, EXCLUDED.update_id),
+                        updated_at = EXCLUDED.updated_at
+                ''', self._bot_id, update_id)
+                self._saved_update_id = update_id
+        except Exception as e:
+            logging.error(f"Error saving update offset: {e}")
+
+    async def prune(self):
+        """Удаление захватов старше table_keep от наибольшего захваченного id"""
+        for bot_id, max_claimed in list(self._max_claimed.items()):
+            below = max_claimed - self.table_keep
+            if below <= self._pruned_below.get(bot_id, 0):
+                continue
+            try:
+                async with get_db_connection() as conn:
+                    if not conn:
+                        return
+                    await conn.execute(
+                        'DELETE FROM mss_processed_updates WHERE bot_id = $1 AND update_id < $2',
+                        bot_id, below,
+                    )
+                self._pruned_below[bot_id] = below
+            except Exception as e:
+                logging.error(f"Error pruning processed updates: {e}")
+
+    def start(self, bot_id=None):
+        """Периодическая очистка таблицы; с bot_id — ещё и сохранение offset (polling)"""
+        if bot_id is not None:
+            self._bot_id = bot_id
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save_offset()
+        await self.prune()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.save_offset()
+            await self.prune()
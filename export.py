@@ -0,0 +1,183 @@
+"""Выгрузка пользователей, сообщений и результатов тестов в CSV/NDJSON.
+
+    python export.py messages --since 2024-01-01 --type menu_button -o messages.csv
+    python export.py users --format ndjson > users.ndjson
+    python export.py quiz_results --quiz mini --compression gzip -o quiz.ndjson.gz
+
+Данные идут потоком через COPY TO STDOUT: память не зависит от числа строк.
+Сообщения и результаты тестов выгружаются в порядке хранения, без сортировки.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from archive import NDJSON_COPY_OPTIONS, open_compressed
+from db import get_db_connection, create_pool, close_pool
+
+PROGRESS_INTERVAL_SEC = 2.0
+
+# Таблица, колонки и порядок выгрузки. Сортировка только там, где её отдаёт
+# индекс (mss_users по user_id); журнал и результаты тестов идут в порядке
+# хранения (mss_chat — по месячным секциям): ORDER BY created_at сортировал бы
+# всю таблицу
+EXPORT_TABLES = {
+    'users': (
+        'mss_users',
+        ('user_id', 'username', 'first_name', 'last_name', 'created_at', 'last_activity'),
+        'user_id',
+    ),
+    'messages': (
+        'mss_chat',
+        ('id', 'user_id', 'username', 'message_text', 'message_type', 'created_at'),
+        None,
+    ),
+    'quiz_results': (
+        'quiz_results',
+        ('id', 'quiz_id', 'user_id', 'level', 'answers', 'free_answers', 'created_at'),
+        None,
+    ),
+}
+
+def build_query(kind, since=None, until=None, user_id=None, message_type=None, quiz_id=None):
+    """SELECT с фильтрами и его параметры"""
+    table, columns, order = EXPORT_TABLES[kind]
+    conditions = []
+    args = []
+
+    def add(condition, value):
+        args.append(value)
+        conditions.append(condition.format(f'${len(args)}'))
+
+    if since:
+        add('created_at >= {}', since)
+    if until:
+        add('created_at < {}', until)
+    if user_id:
+        add('user_id = {}', user_id)
+    if message_type:
+        if kind != 'messages':
+            raise ValueError("--type applies to messages only")
+        add('message_type = {}', message_type)
+    if quiz_id:
+        if kind != 'quiz_results':
+            raise ValueError("--quiz applies to quiz_results only")
+        add('quiz_id = {}', quiz_id)
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    if order:
+        query += f" ORDER BY {order}"
+    return query, args
+
+class Progress:
+    """Отчёт о ходе выгрузки в stderr не чаще раза в PROGRESS_INTERVAL_SEC"""
+
+    def __init__(self, count_rows, enabled=True):
+        self.count_rows = count_rows
+        self.enabled = enabled
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def add(self, data):
+        self.bytes += len(data)
+        if self.count_rows:
+            self.rows += data.count(b'\n')
+        now = time.monotonic()
+        if self.enabled and now - self.reported >= PROGRESS_INTERVAL_SEC:
+            self.reported = now
+            self.report(now)
+
+    def report(self, now, rows=None):
+        elapsed = now - self.started
+        rows = self.rows if rows is None else rows
+        counted = f"{rows} rows, " if self.count_rows or rows else ''
+        print(
+            f"\r{counted}{self.bytes / 1048576:.1f} MB, {elapsed:.0f} s",
+            end='', file=sys.stderr, flush=True,
+        )
+
+async def export(kind, out, fmt='csv', progress=None, **filters):
+    """Выгрузка в открытый бинарный поток out; возвращает число строк или None"""
+    query, args = build_query(kind, **filters)
+    if fmt == 'ndjson':
+        query = f'SELECT row_to_json(t)::text FROM ({query}) AS t'
+        options = NDJSON_COPY_OPTIONS
+    else:
+        options = {'format': 'csv', 'header': True}
+
+    async def write(data):
+        out.write(data)
+        if progress:
+            progress.add(data)
+
+    async with get_db_connection() as conn:
+        if not conn:
+            return None
+        status = await conn.copy_from_query(query, *args, output=write, **options)
+    out.flush()
+    return int(status.split()[-1])
+
+def parse_day(value):
+    return datetime.combine(date.fromisoformat(value), datetime.min.time())
+
+async def main():
+    parser = argparse.ArgumentParser(description="Выгрузка данных бота")
+    parser.add_argument('kind', choices=tuple(EXPORT_TABLES))
+    parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+    parser.add_argument('--compression', choices=('gzip', 'zstd'), help="сжимать вывод (нужен -o)")
+    parser.add_argument('-o', '--output', help="файл; по умолчанию stdout")
+    parser.add_argument('--since', type=parse_day, help="YYYY-MM-DD, включительно")
+    parser.add_argument('--until', type=parse_day, help="YYYY-MM-DD, включительно")
+    parser.add_argument('--user', type=int, dest='user_id')
+    parser.add_argument('--type', dest='message_type', help="message_type для messages")
+    parser.add_argument('--quiz', dest='quiz_id', help="quiz_id для quiz_results")
+    parser.add_argument('--quiet', action='store_true', help="без отчёта о ходе выгрузки")
+    parser.add_argument('--timeout', type=float, help="предел на всю выгрузку, секунды; по умолчанию без предела")
+    args = parser.parse_args()
+
+    if args.compression and not args.output:
+        parser.error("--compression requires --output")
+    until = args.until + timedelta(days=1) if args.until else None
+    try:
+        build_query(args.kind, args.since, until, args.user_id, args.message_type, args.quiz_id)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    if args.compression:
+        out = open_compressed(args.output, 'w', args.compression)
+    elif args.output:
+        out = open(args.output, 'wb')
+    else:
+        out = sys.stdout.buffer
+    # В NDJSON перевод строки только между записями, поэтому строки считаются точно
+    progress = Progress(count_rows=args.format == 'ndjson', enabled=not args.quiet)
+
+    # Таймаут пула бота (DB_COMMAND_TIMEOUT) действовал бы на весь COPY
+    await create_pool(command_timeout=args.timeout or None)
+    try:
+        rows = await export(
+            args.kind, out, args.format, progress,
+            since=args.since, until=until, user_id=args.user_id,
+            message_type=args.message_type, quiz_id=args.quiz_id,
+        )
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        await close_pool()
+
+    if rows is None:
+        logging.error("Database unavailable")
+        sys.exit(1)
+    if not args.quiet:
+        progress.report(time.monotonic(), rows)
+        print(file=sys.stderr)
+
+if __name__ == '__main__':
+    asyncio.run(main())
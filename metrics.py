@@ -0,0 +1,252 @@
+import bisect
+import logging
+import time
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from config import METRICS_HOST, METRICS_PORT, SLOW_UPDATE_MS
+
+# Границы гистограммы задержки обновления, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Трасса обновления, которое сейчас обрабатывается в этой задаче
+current_trace = ContextVar('current_trace', default=None)
+
+class UpdateTrace:
+    """Тайминги одного обновления: этапы, запросы к БД и к Bot API"""
+
+    __slots__ = ('started', 'handler', 'stages', 'db_calls', 'db_time',
+                 'acquire_time', 'api_calls', 'api_time', 'done')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler = 'unhandled'
+        self.stages = []  # (смещение от начала, этап, длительность)
+        self.db_calls = 0
+        self.db_time = 0.0
+        self.acquire_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+        self.done = False
+
+    def stage(self, name, started, elapsed):
+        self.stages.append((started - self.started, name, elapsed))
+
+class HandlerStats:
+    __slots__ = ('count', 'errors', 'buckets', 'latency_sum',
+                 'db_calls', 'db_time', 'acquire_time', 'api_calls', 'api_time')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.db_calls = 0
+        self.db_time = 0.0
+        self.acquire_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+
+class Metrics:
+    """Счётчики по имени хэндлера и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self, slow_update_ms=SLOW_UPDATE_MS):
+        self.slow_update = slow_update_ms / 1000
+        self.handlers = {}
+
+    def _stats(self, handler):
+        stats = self.handlers.get(handler)
+        if stats is None:
+            stats = self.handlers[handler] = HandlerStats()
+        return stats
+
+    def record(self, trace, elapsed, failed):
+        stats = self._stats(trace.handler)
+        stats.count += 1
+        stats.errors += failed
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        stats.latency_sum += elapsed
+        stats.db_calls += trace.db_calls
+        stats.db_time += trace.db_time
+        stats.acquire_time += trace.acquire_time
+        stats.api_calls += trace.api_calls
+        stats.api_time += trace.api_time
+
+        if elapsed >= self.slow_update:
+            self.log_slow(trace, elapsed)
+
+    def record_late_query(self, trace, elapsed):
+        """Запрос, о котором asyncpg сообщил уже после конца обновления"""
+        stats = self._stats(trace.handler)
+        stats.db_calls += 1
+        stats.db_time += elapsed
+
+    @staticmethod
+    def log_slow(trace, elapsed):
+        other = elapsed - trace.db_time - trace.acquire_time - trace.api_time
+        lines = [
+            f"Slow update: {trace.handler} took {elapsed * 1000:.1f} ms "
+            f"(db {trace.db_calls} calls {trace.db_time * 1000:.1f} ms, "
+            f"acquire {trace.acquire_time * 1000:.1f} ms, "
+            f"api {trace.api_calls} calls {trace.api_time * 1000:.1f} ms, "
+            f"other {other * 1000:.1f} ms)"
+        ]
+        for offset, name, duration in sorted(trace.stages):
+            lines.append(f"  +{offset * 1000:8.1f} ms  {duration * 1000:8.1f} ms  {name}")
+        logging.warning("\n".join(lines))
+
+    def render(self):
+        """Текст для /metrics"""
+        lines = [
+            '# HELP mss_update_duration_seconds Update processing time by handler',
+            '# TYPE mss_update_duration_seconds histogram',
+        ]
+        for handler, stats in sorted(self.handlers.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'mss_update_duration_seconds_bucket{{handler="{handler}",le="{bound}"}} {cumulative}')
+            lines.append(f'mss_update_duration_seconds_bucket{{handler="{handler}",le="+Inf"}} {stats.count}')
+            lines.append(f'mss_update_duration_seconds_sum{{handler="{handler}"}} {stats.latency_sum:.6f}')
+            lines.append(f'mss_update_duration_seconds_count{{handler="{handler}"}} {stats.count}')
+
+        counters = (
+            ('mss_update_errors_total', 'Updates that raised an exception', 'errors', False),
+            ('mss_db_calls_total', 'Database queries made while handling updates', 'db_calls', False),
+            ('mss_db_seconds_total', 'Time spent in database queries', 'db_time', True),
+            ('mss_db_acquire_seconds_total', 'Time spent waiting for a pool connection', 'acquire_time', True),
+            ('mss_api_calls_total', 'Bot API requests made while handling updates', 'api_calls', False),
+            ('mss_api_seconds_total', 'Time spent in Bot API requests', 'api_time', True),
+        )
+        for name, help_text, field, seconds in counters:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for handler, stats in sorted(self.handlers.items()):
+                value = getattr(stats, field)
+                lines.append(f'{name}{{handler="{handler}"}} {value:.6f}' if seconds else f'{name}{{handler="{handler}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: время всего обновления, включая фильтры"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        trace = UpdateTrace()
+        token = current_trace.set(trace)
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            current_trace.reset(token)
+            trace.done = True
+            self.metrics.record(trace, time.perf_counter() - trace.started, failed)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: имя сработавшего хэндлера и время его работы"""
+
+    async def __call__(self, handler, event, data):
+        trace = current_trace.get()
+        if trace is None:
+            return await handler(event, data)
+
+        handler_object = data.get('handler')
+        section = data.get('section')
+        if section is not None:
+            # Все кнопки меню идут через один хэндлер — метка по разделу
+            trace.handler = getattr(section[0], '__name__', 'handler')
+        elif handler_object is not None:
+            trace.handler = getattr(handler_object.callback, '__name__', 'handler')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            trace.stage(f"handler {trace.handler}", started, time.perf_counter() - started)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API (без ожидания в планировщике отправки)"""
+
+    async def __call__(self, make_request, bot, method):
+        trace = current_trace.get()
+        if trace is None:
+            return await make_request(bot, method)
+
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            trace.api_calls += 1
+            trace.api_time += elapsed
+            trace.stage(f"api {method.__api_method__}", started, elapsed)
+
+class DbMetrics:
+    """Подключение к соединениям пула: запросы и ожидание соединения"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def attach(self, conn):
+        conn.add_query_logger(self._on_query)
+
+    def _on_query(self, record):
+        # asyncpg вызывает логгер через call_soon в контексте запроса
+        trace = current_trace.get()
+        if trace is None:
+            return
+        if trace.done:
+            self.metrics.record_late_query(trace, record.elapsed)
+            return
+        trace.db_calls += 1
+        trace.db_time += record.elapsed
+        query = ' '.join(record.query.split())[:60]
+        trace.stages.append((time.perf_counter() - record.elapsed - trace.started, f"db {query}", record.elapsed))
+
+    @staticmethod
+    def on_acquire(elapsed):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.acquire_time += elapsed
+
+# Метрики процесса; None, пока не включены
+metrics = None
+
+def install_metrics(dp, bot, slow_update_ms=SLOW_UPDATE_MS):
+    """Подключение middleware к диспетчеру и сессии бота.
+
+    Возвращает init для create_pool(); при выключенных метриках ничего
+    не подключается и обновления идут без лишних вызовов.
+    """
+    global metrics
+    import db
+
+    metrics = Metrics(slow_update_ms)
+    dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+
+    db_metrics = DbMetrics(metrics)
+    db.acquire_observer = db_metrics.on_acquire
+    return db_metrics.attach
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Локальный HTTP /metrics; возвращает runner для остановки"""
+    # aiohttp.web нужен только с метриками — не грузим его при каждом старте
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics: http://{host}:{port}/metrics")
+    return runner
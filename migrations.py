@@ -0,0 +1,375 @@
+import asyncio
+import logging
+
+from config import CHAT_PARTITIONS_AHEAD, CHAT_PARTITIONS_CHECK_SEC, DB_MIGRATION_TIMEOUT
+from db import get_db_connection
+
+# Ключ pg_advisory_lock: миграции выполняет один процесс за раз
+MIGRATIONS_LOCK_ID = 7300
+
+# Версии схемы: (номер, описание, SQL-команды).
+# Применённые версии не меняются — любые изменения только новой версией.
+MIGRATIONS = [
+    (1, "users and chat log", [
+        '''
+        CREATE TABLE IF NOT EXISTS mss_users (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT UNIQUE NOT NULL,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS mss_chat (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message_text TEXT,
+            message_type VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "fsm storage", [
+        '''
+        CREATE TABLE IF NOT EXISTS mss_fsm (
+            bot_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            state VARCHAR(255),
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot_id, chat_id, user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS mss_fsm_updated_at_idx ON mss_fsm (updated_at)',
+    ]),
+    (3, "broadcasts", [
+        'ALTER TABLE mss_users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP',
+        '''
+        CREATE TABLE IF NOT EXISTS mss_broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            created_by BIGINT,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS mss_broadcast_recipients (
+            broadcast_id INTEGER NOT NULL REFERENCES mss_broadcasts (id),
+            user_id BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            error TEXT,
+            sent_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        )
+        ''',
+    ]),
+    (4, "monthly partitions and indexes for mss_chat", [
+        # Создание недостающих помесячных секций в диапазоне [from_month, to_month]
+        '''
+        CREATE OR REPLACE FUNCTION mss_chat_ensure_partitions(from_month DATE, to_month DATE)
+        RETURNS INTEGER AS $$
+        DECLARE
+            cur_month DATE := date_trunc('month', from_month)::date;
+            created INTEGER := 0;
+            partition_name TEXT;
+        BEGIN
+            WHILE cur_month <= to_month LOOP
+                partition_name := format('mss_chat_y%sm%s', to_char(cur_month, 'YYYY'), to_char(cur_month, 'MM'));
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF mss_chat FOR VALUES FROM (%L) TO (%L)',
+                        partition_name, cur_month, (cur_month + interval '1 month')::date
+                    );
+                    created := created + 1;
+                END IF;
+                cur_month := (cur_month + interval '1 month')::date;
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        'ALTER TABLE mss_chat RENAME TO mss_chat_legacy',
+        'ALTER SEQUENCE mss_chat_id_seq RENAME TO mss_chat_legacy_id_seq',
+        '''
+        CREATE TABLE mss_chat (
+            id BIGSERIAL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message_text TEXT,
+            message_type VARCHAR(100),
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        ''',
+        # Страховка для строк вне созданных секций; в норме остаётся пустой
+        'CREATE TABLE mss_chat_default PARTITION OF mss_chat DEFAULT',
+        '''
+        SELECT mss_chat_ensure_partitions(
+            COALESCE((SELECT min(created_at) FROM mss_chat_legacy), now())::date,
+            now()::date
+        )
+        ''',
+        '''
+        INSERT INTO mss_chat (id, user_id, username, message_text, message_type, created_at)
+        SELECT id, user_id, username, message_text, message_type, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM mss_chat_legacy
+        ''',
+        "SELECT setval('mss_chat_id_seq', COALESCE((SELECT max(id) FROM mss_chat), 0) + 1, false)",
+        'DROP TABLE mss_chat_legacy',
+        'CREATE INDEX mss_chat_user_created_idx ON mss_chat (user_id, created_at)',
+        'CREATE INDEX mss_chat_created_brin ON mss_chat USING brin (created_at)',
+    ]),
+    (5, "daily rollups of mss_chat", [
+        '''
+        CREATE TABLE mss_chat_daily (
+            day DATE NOT NULL,
+            message_type VARCHAR(100) NOT NULL,
+            button TEXT NOT NULL DEFAULT '',
+            events BIGINT NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, message_type, button)
+        )
+        ''',
+        # Кто уже учтён в users за день; старые дни удаляются, итоги остаются в mss_chat_daily
+        '''
+        CREATE TABLE mss_chat_daily_users (
+            day DATE NOT NULL,
+            message_type VARCHAR(100) NOT NULL,
+            button TEXT NOT NULL DEFAULT '',
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (day, message_type, button, user_id)
+        )
+        ''',
+        # Перенос истории: единственный полный проход по mss_chat
+        '''
+        INSERT INTO mss_chat_daily (day, message_type, button, events, users)
+        SELECT created_at::date, COALESCE(message_type, ''),
+               CASE WHEN message_type IN ('menu_button', 'command') THEN COALESCE(message_text, '') ELSE '' END,
+               count(*), count(DISTINCT user_id)
+        FROM mss_chat
+        GROUP BY 1, 2, 3
+        ''',
+        '''
+        INSERT INTO mss_chat_daily_users (day, message_type, button, user_id)
+        SELECT DISTINCT created_at::date, COALESCE(message_type, ''),
+               CASE WHEN message_type IN ('menu_button', 'command') THEN COALESCE(message_text, '') ELSE '' END,
+               user_id
+        FROM mss_chat
+        WHERE created_at >= CURRENT_DATE - 1
+        ''',
+    ]),
+    (6, "typed quiz results", [
+        # answers — номера выбранных вариантов по порядку вопросов (NULL — свободный ответ)
+        '''
+        CREATE TABLE quiz_results (
+            id BIGSERIAL PRIMARY KEY,
+            quiz_id VARCHAR(64) NOT NULL,
+            user_id BIGINT NOT NULL,
+            level VARCHAR(64) NOT NULL,
+            answers SMALLINT[] NOT NULL,
+            free_answers TEXT[] NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Последний результат пользователя и защита от повторного переноса истории
+        'CREATE UNIQUE INDEX quiz_results_user_quiz_created_idx ON quiz_results (user_id, quiz_id, created_at)',
+        # Сводки по тесту за период читаются только из индекса
+        '''
+        CREATE INDEX quiz_results_quiz_created_idx ON quiz_results (quiz_id, created_at)
+        INCLUDE (level, answers)
+        ''',
+    ]),
+    (7, "spool replay log", [
+        # Перенесённые порции локального журнала (spool.py): защита от повторной записи
+        '''
+        CREATE TABLE mss_spool_replayed (
+            segment TEXT NOT NULL,
+            chunk_offset BIGINT NOT NULL,
+            replayed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (segment, chunk_offset)
+        )
+        ''',
+    ]),
+    (8, "support tickets", [
+        '''
+        CREATE TABLE support_tickets (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_name TEXT NOT NULL,
+            question TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'open',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            answered_at TIMESTAMP,
+            admin_message_id BIGINT
+        )
+        ''',
+        # Открытых тикетов мало — частичный индекс остаётся маленьким
+        "CREATE INDEX support_tickets_open_idx ON support_tickets (created_at) WHERE status = 'open'",
+        'CREATE INDEX support_tickets_admin_message_idx ON support_tickets (admin_message_id)',
+    ]),
+    (9, "processed updates", [
+        '''
+        CREATE TABLE mss_processed_updates (
+            bot_id BIGINT NOT NULL,
+            update_id BIGINT NOT NULL,
+            PRIMARY KEY (bot_id, update_id)
+        )
+        ''',
+        '''
+        CREATE TABLE mss_bot_offsets (
+            bot_id BIGINT PRIMARY KEY,
+            update_id BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (10, "spool replay ranges", [
+        # Конец перенесённой порции: отметки не зависят от SPOOL_REPLAY_BATCH
+        'ALTER TABLE mss_spool_replayed ADD COLUMN end_offset BIGINT',
+    ]),
+    (11, "move default partition rows into new mss_chat partitions", [
+        # Строки месяца в mss_chat_default не дают создать его секцию через
+        # PARTITION OF: секция создаётся отдельно, строки переносятся в неё,
+        # и только потом она подключается к mss_chat
+        '''
+        CREATE OR REPLACE FUNCTION mss_chat_ensure_partitions(from_month DATE, to_month DATE)
+        RETURNS INTEGER AS $$
+        DECLARE
+            cur_month DATE := date_trunc('month', from_month)::date;
+            next_month DATE;
+            created INTEGER := 0;
+            partition_name TEXT;
+        BEGIN
+            WHILE cur_month <= to_month LOOP
+                next_month := (cur_month + interval '1 month')::date;
+                partition_name := format('mss_chat_y%sm%s', to_char(cur_month, 'YYYY'), to_char(cur_month, 'MM'));
+                IF to_regclass(partition_name) IS NULL THEN
+                    IF EXISTS (
+                        SELECT 1 FROM mss_chat_default WHERE created_at >= cur_month AND created_at < next_month
+                    ) THEN
+                        EXECUTE format('CREATE TABLE %I (LIKE mss_chat INCLUDING DEFAULTS)', partition_name);
+                        EXECUTE format(
+                            'WITH moved AS (DELETE FROM mss_chat_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                            'INSERT INTO %I SELECT * FROM moved',
+                            cur_month, next_month, partition_name
+                        );
+                        EXECUTE format(
+                            'ALTER TABLE mss_chat ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                            partition_name, cur_month, next_month
+                        );
+                    ELSE
+                        EXECUTE format(
+                            'CREATE TABLE %I PARTITION OF mss_chat FOR VALUES FROM (%L) TO (%L)',
+                            partition_name, cur_month, next_month
+                        );
+                    END IF;
+                    created := created + 1;
+                END IF;
+                cur_month := next_month;
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+async def schema_is_current(conn):
+    """Применена ли последняя версия схемы: один SELECT без блокировок и DDL"""
+    import asyncpg
+
+    try:
+        version = await conn.fetchval('SELECT max(version) FROM mss_schema_version')
+    except asyncpg.exceptions.UndefinedTableError:
+        return False
+    return version is not None and version >= LATEST_VERSION
+
+async def apply_migrations(conn):
+    """Применение недостающих версий схемы; возвращает число применённых"""
+    # Другой процесс может в это время применять те же миграции
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID, timeout=DB_MIGRATION_TIMEOUT)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS mss_schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        applied = {row['version'] for row in await conn.fetch('SELECT version FROM mss_schema_version')}
+
+        count = 0
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+
+            async with conn.transaction():
+                for statement in statements:
+                    # Перенос mss_chat и пересчёт сводок идут дольше DB_COMMAND_TIMEOUT
+                    await conn.execute(statement, timeout=DB_MIGRATION_TIMEOUT)
+                await conn.execute(
+                    'INSERT INTO mss_schema_version (version, name) VALUES ($1, $2)', version, name
+                )
+            logging.info(f"Applied schema migration {version}: {name}")
+            count += 1
+        return count
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_ID)
+
+async def ensure_chat_partitions(conn, months_ahead=CHAT_PARTITIONS_AHEAD):
+    """Создание секций mss_chat на текущий и months_ahead следующих месяцев.
+
+    Строки, попавшие в mss_chat_default (месяц без секции: заранее не
+    создан, удалён архивацией), переносятся в секции своих месяцев.
+    """
+    stray = await conn.fetchrow('''
+        SELECT count(*) AS rows, min(created_at) AS first, max(created_at) AS last
+        FROM mss_chat_default
+    ''')
+    if stray['rows']:
+        logging.warning(
+            f"mss_chat_default holds {stray['rows']} rows from {stray['first']} to {stray['last']}, "
+            f"moving them to monthly partitions"
+        )
+        await conn.fetchval(
+            'SELECT mss_chat_ensure_partitions($1::date, $2::date)', stray['first'].date(), stray['last'].date()
+        )
+
+    created = await conn.fetchval('''
+        SELECT mss_chat_ensure_partitions(
+            now()::date,
+            (date_trunc('month', now()) + make_interval(months => $1))::date
+        )
+    ''', months_ahead)
+    if created:
+        logging.info(f"Created {created} mss_chat partitions")
+    return created
+
+async def run_partition_maintenance(interval=CHAT_PARTITIONS_CHECK_SEC):
+    """Фоновая задача: секции на следующие месяцы создаются заранее.
+
+    Первая проверка — сразу после старта, но уже после того, как бот
+    начал отвечать.
+    """
+    while True:
+        try:
+            async with get_db_connection() as conn:
+                if conn:
+                    await ensure_chat_partitions(conn)
+        except Exception as e:
+            logging.error(f"Error creating mss_chat partitions: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,29 @@
+import json
+
+from aiogram.methods import SendMessage
+
+# Шаблоны SendMessage для неизменяемых ответов: (текст, клавиатура) -> метод
+_templates = {}
+
+def prebuilt_markup(markup):
+    """Клавиатура, один раз сериализованная в JSON для Bot API.
+
+    Такую строку сессия aiogram отправляет как есть, без повторного
+    model_dump() и json.dumps() всего дерева кнопок на каждый ответ.
+    """
+    return json.dumps(markup.model_dump(exclude_none=True), ensure_ascii=False)
+
+async def answer_static(message, text, reply_markup=None):
+    """Ответ неизменяемым текстом и заранее сериализованной клавиатурой.
+
+    SendMessage собирается один раз на пару (текст, клавиатура), дальше
+    на каждый запрос копируется шаблон с нужным chat_id — без валидации
+    pydantic. Только для статических текстов: кэш шаблонов не ограничен.
+    """
+    key = (text, reply_markup)
+    template = _templates.get(key)
+    if template is None:
+        template = SendMessage.model_construct(chat_id=0, text=text, reply_markup=reply_markup)
+        _templates[key] = template
+
+    return await message.bot(template.model_copy(update={"chat_id": message.chat.id}))
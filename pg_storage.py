@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import (
+    FSM_CACHE_SIZE,
+    FSM_CACHE_TTL,
+    FSM_STATE_TTL,
+    FSM_SWEEP_INTERVAL,
+    FSM_SWEEP_BATCH,
+)
+from db import get_db_connection
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в таблице mss_fsm с локальным write-through кэшем.
+
+    Запись ключуется по (bot_id, chat_id, user_id): бот работает только в
+    личных чатах без тем, поэтому thread_id и destiny не используются.
+    Пустые записи (нет состояния и данных) удаляются, а брошенные состояния
+    старше state_ttl вычищаются фоновой задачей пачками по sweep_batch строк.
+
+    Кэш считается верным не дольше cache_ttl: этого достаточно, пока
+    обновления одного пользователя обрабатывает один процесс.
+    """
+
+    def __init__(self, cache_size=FSM_CACHE_SIZE, cache_ttl=FSM_CACHE_TTL,
+                 state_ttl=FSM_STATE_TTL, sweep_interval=FSM_SWEEP_INTERVAL,
+                 sweep_batch=FSM_SWEEP_BATCH):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+
+        self._cache = OrderedDict()  # (bot, chat, user) -> (state, data, время кэширования)
+        self._task = None
+
+    @staticmethod
+    def _row_key(key):
+        return (key.bot_id, key.chat_id, key.user_id)
+
+    def _remember(self, row_key, state, data):
+        self._cache[row_key] = (state, data, time.monotonic())
+        self._cache.move_to_end(row_key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key):
+        row_key = self._row_key(key)
+        entry = self._cache.get(row_key)
+        if entry is not None and time.monotonic() - entry[2] <= self.cache_ttl:
+            self._cache.move_to_end(row_key)
+            return entry[0], entry[1]
+
+        state, data = None, {}
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    # БД недоступна — последнее известное значение лучше пустого
+                    return (entry[0], entry[1]) if entry is not None else (state, data)
+
+                row = await conn.fetchrow('''
+                    SELECT state, data FROM mss_fsm
+                    WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND updated_at > $4
+                ''', *row_key, datetime.now() - timedelta(seconds=self.state_ttl))
+                if row is not None:
+                    state, data = row['state'], json.loads(row['data'])
+        except Exception as e:
+            logging.error(f"Error reading FSM state from database: {e}")
+            if entry is not None:
+                return entry[0], entry[1]
+
+        self._remember(row_key, state, data)
+        return state, data
+
+    async def _store(self, key, state, data):
+        row_key = self._row_key(key)
+        self._remember(row_key, state, data)
+
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    return
+
+                if state is None and not data:
+                    await conn.execute('''
+                        DELETE FROM mss_fsm WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3
+                    ''', *row_key)
+                else:
+                    await conn.execute('''
+                        INSERT INTO mss_fsm (bot_id, chat_id, user_id, state, data, updated_at)
+                        VALUES ($1, $2, $3, $4, $5::jsonb, $6)
+                        ON CONFLICT (bot_id, chat_id, user_id)
+                        DO UPDATE SET
+                            state = EXCLUDED.state,
+                            data = EXCLUDED.data,
+                            updated_at = EXCLUDED.updated_at
+                    ''', *row_key, state, json.dumps(data, ensure_ascii=False), datetime.now())
+        except Exception as e:
+            logging.error(f"Error writing FSM state to database: {e}")
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        _, data = await self._load(key)
+        await self._store(key, state, data)
+
+    async def get_state(self, key):
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key, data):
+        state, _ = await self._load(key)
+        await self._store(key, state, data.copy())
+
+    async def get_data(self, key):
+        _, data = await self._load(key)
+        return data.copy()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep(self):
+        """Удаление брошенных состояний пачками; возвращает число удалённых строк"""
+        deadline = datetime.now() - timedelta(seconds=self.state_ttl)
+        removed = 0
+
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    return removed
+
+                while True:
+                    result = await conn.execute('''
+                        DELETE FROM mss_fsm
+                        WHERE ctid IN (
+                            SELECT ctid FROM mss_fsm
+                            WHERE updated_at < $1
+                            LIMIT $2
+                        )
+                    ''', deadline, self.sweep_batch)
+                    count = int(result.split()[-1])
+                    removed += count
+                    if count < self.sweep_batch:
+                        break
+        except Exception as e:
+            logging.error(f"Error sweeping expired FSM states: {e}")
+
+        if removed:
+            logging.info(f"FSM: removed {removed} expired states")
+        return removed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+def create_fsm_storage(kind):
+    """Хранилище FSM по настройке FSM_STORAGE"""
+    if kind == 'postgres':
+        return PostgresStorage()
+    if kind == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown FSM storage: {kind}")
@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+from payloads import prebuilt_markup, answer_static
+
+@dataclass(frozen=True)
+class Question:
+    """Вопрос теста; без вариантов ответа — свободный текст"""
+    key: str
+    text: str
+    options: tuple = ()
+
+@dataclass(frozen=True)
+class Level:
+    """Уровень по итогам теста.
+
+    requires — {ключ вопроса: номер варианта}; уровни проверяются по порядку,
+    выбирается первый, у которого совпали все условия (пустые — всегда).
+    """
+    name: str
+    emoji: str
+    recommendation: str
+    requires: dict = field(default_factory=dict)
+
+@dataclass(frozen=True)
+class Quiz:
+    quiz_id: str
+    intro: str
+    questions: tuple
+    levels: tuple
+    result_template: str
+    invalid_answer_text: str = "Пожалуйста, выберите один из предложенных вариантов:"
+
+@dataclass(frozen=True)
+class QuizStep:
+    """Шаг скомпилированного теста: всё, что нужно хэндлеру, посчитано заранее"""
+    quiz: Quiz
+    index: int
+    question: Question
+    state: str
+    prompt: str
+    markup: str
+    option_index: dict
+    next_step: "QuizStep" = None
+
+@dataclass(frozen=True)
+class QuizResult:
+    quiz: Quiz
+    answers: dict
+    level: Level
+
+    def answer_text(self, key):
+        """Ответ на вопрос так, как его видел пользователь"""
+        answer = self.answers.get(key)
+        question = next(q for q in self.quiz.questions if q.key == key)
+        if question.options and isinstance(answer, int):
+            return question.options[answer]
+        return answer
+
+    def text(self):
+        return self.quiz.result_template.format(
+            emoji=self.level.emoji,
+            level=self.level.name,
+            recommendation=self.level.recommendation,
+        )
+
+# Клавиатура для вопросов со свободным ответом
+REMOVE_MARKUP = prebuilt_markup(ReplyKeyboardMarkup(keyboard=[], resize_keyboard=True))
+
+def quiz_state(quiz_id, index):
+    return f"quiz:{quiz_id}:{index}"
+
+class QuizEngine:
+    """Тесты, собранные из описаний в конечный автомат.
+
+    Состояние FSM — "quiz:<id>:<номер вопроса>"; по нему один хэндлер
+    находит шаг словарным поиском, а ответ — по заранее построенной
+    карте «текст кнопки -> номер варианта». Несколько тестов работают
+    одновременно, у каждого свои состояния.
+    """
+
+    def __init__(self):
+        self.quizzes = {}
+        self.steps = {}  # состояние FSM -> QuizStep
+
+    def register(self, quiz):
+        if quiz.quiz_id in self.quizzes:
+            raise ValueError(f"Quiz {quiz.quiz_id!r} is already registered")
+
+        total = len(quiz.questions)
+        next_step = None
+        for index in reversed(range(total)):
+            question = quiz.questions[index]
+            prompt = f"Вопрос {index + 1} из {total}\n\n{question.text}"
+            if index == 0:
+                prompt = f"{quiz.intro}\n\n{prompt}"
+
+            if question.options:
+                markup = prebuilt_markup(ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text=option)] for option in question.options],
+                    resize_keyboard=True,
+                ))
+            else:
+                markup = REMOVE_MARKUP
+
+            step = QuizStep(
+                quiz=quiz,
+                index=index,
+                question=question,
+                state=quiz_state(quiz.quiz_id, index),
+                prompt=prompt,
+                markup=markup,
+                option_index={option: i for i, option in enumerate(question.options)},
+                next_step=next_step,
+            )
+            self.steps[step.state] = step
+            next_step = step
+
+        self.quizzes[quiz.quiz_id] = quiz
+        return quiz
+
+    def step_filter(self, message, raw_state=None):
+        """Фильтр aiogram: пропускает сообщения пользователей, проходящих тест"""
+        step = self.steps.get(raw_state)
+        if step is None:
+            return False
+        return {"quiz_step": step}
+
+    async def start(self, message, state, quiz_id):
+        first = self.steps[quiz_state(quiz_id, 0)]
+        await state.set_state(first.state)
+        await state.set_data({})
+        await answer_static(message, first.prompt, reply_markup=first.markup)
+
+    async def answer(self, message, state, step):
+        """Приём ответа на текущий шаг; QuizResult, если тест завершён"""
+        question = step.question
+        if question.options:
+            answer = step.option_index.get(message.text)
+            if answer is None:
+                await answer_static(message, step.quiz.invalid_answer_text, reply_markup=step.markup)
+                return None
+        else:
+            answer = message.text
+
+        answers = await state.update_data({question.key: answer})
+        if step.next_step is not None:
+            await state.set_state(step.next_step.state)
+            await answer_static(message, step.next_step.prompt, reply_markup=step.next_step.markup)
+            return None
+
+        await state.clear()
+        return QuizResult(quiz=step.quiz, answers=answers, level=self.score(step.quiz, answers))
+
+    @staticmethod
+    def score(quiz, answers):
+        for level in quiz.levels:
+            if all(answers.get(key) == option for key, option in level.requires.items()):
+                return level
+        return quiz.levels[-1]
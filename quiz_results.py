@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from config import QUIZ_RESULT_CACHE_SIZE, QUIZ_RESULT_CACHE_TTL
+from db import get_db_connection, create_pool, close_pool
+
+# Колонки quiz_results в порядке записей из chat_log (created_at добавляется там же)
+QUIZ_RESULT_COLUMNS = ('quiz_id', 'user_id', 'level', 'answers', 'free_answers', 'created_at')
+
+# Формат текстовых результатов в mss_chat, по нему идёт перенос истории
+LEGACY_RESULT_RE = re.compile(r'^Результат теста - Уровень: (.*?)\. Ответы: (.*)$', re.S)
+LEGACY_QUIZ_ID = 'mini'
+BACKFILL_CHUNK = 5000
+
+def quiz_result_row(user_id, result):
+    """Строка quiz_results из QuizResult (без created_at).
+
+    answers — номера выбранных вариантов по порядку вопросов, NULL для
+    вопросов со свободным ответом; их тексты — в free_answers.
+    """
+    answers = []
+    free_answers = []
+    for question in result.quiz.questions:
+        value = result.answers.get(question.key)
+        if question.options:
+            answers.append(value if isinstance(value, int) else None)
+        else:
+            answers.append(None)
+            free_answers.append(value)
+    return result.quiz.quiz_id, user_id, result.level.name, answers, free_answers
+
+async def fetch_quiz_summary(quiz_id, days):
+    """Распределение уровней и гистограммы ответов за последние days дней.
+
+    Оба запроса читают только индекс quiz_results_quiz_created_idx.
+    """
+    since = datetime.now() - timedelta(days=days)
+    async with get_db_connection() as conn:
+        if not conn:
+            return None
+        levels = await conn.fetch('''
+            SELECT level, count(*) AS results
+            FROM quiz_results
+            WHERE quiz_id = $1 AND created_at >= $2
+            GROUP BY level
+            ORDER BY results DESC
+        ''', quiz_id, since)
+        answers = await conn.fetch('''
+            SELECT a.question, a.option, count(*) AS results
+            FROM quiz_results r,
+                 unnest(r.answers) WITH ORDINALITY AS a(option, question)
+            WHERE r.quiz_id = $1 AND r.created_at >= $2 AND a.option IS NOT NULL
+            GROUP BY a.question, a.option
+            ORDER BY a.question, a.option
+        ''', quiz_id, since)
+        return levels, answers
+
+def format_quiz_summary(quiz, levels, answers, days):
+    total = sum(row['results'] for row in levels)
+    lines = [f"🧩 Тест «{quiz.quiz_id}» за {days} дн.: {total} результатов", ""]
+    for row in levels:
+        share = row['results'] * 100 / total if total else 0
+        lines.append(f"{row['level']}: {row['results']} ({share:.0f}%)")
+
+    by_question = {}
+    for row in answers:
+        by_question.setdefault(row['question'], {})[row['option']] = row['results']
+
+    for number, question in enumerate(quiz.questions, 1):
+        if not question.options:
+            continue
+        counts = by_question.get(number, {})
+        lines += ["", f"Вопрос {number}:"]
+        for index, option in enumerate(question.options):
+            lines.append(f"{option}: {counts.get(index, 0)}")
+    return "\n".join(lines)
+
+class LatestResultCache:
+    """Последний результат теста по (user_id, quiz_id) для /mylevel.
+
+    LRU/TTL-кэш: промах читает одну строку по индексу
+    quiz_results_user_quiz_created_idx, затем ответ хранится в памяти не
+    дольше ttl секунд. Отсутствие результата тоже запоминается. Новый
+    результат кладётся сюда при записи (remember()), поэтому повторные
+    запросы в БД не идут, даже пока сама строка ещё в очереди chat_log.
+    Результат, записанный другой репликой (webhook), виден не позже чем
+    через ttl.
+    """
+
+    def __init__(self, max_size=QUIZ_RESULT_CACHE_SIZE, ttl=QUIZ_RESULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._results = OrderedDict()  # (user_id, quiz_id) -> ((level, created_at) или None, время записи)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def remember(self, user_id, quiz_id, level, created_at):
+        self._store((user_id, quiz_id), (level, created_at))
+
+    def forget(self, user_id, quiz_id):
+        self._results.pop((user_id, quiz_id), None)
+
+    def _store(self, key, value):
+        self._results[key] = (value, time.monotonic())
+        self._results.move_to_end(key)
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def _cached(self, key):
+        """Значение из памяти; KeyError, если его нет или срок истёк"""
+        value, stored_at = self._results[key]
+        if time.monotonic() - stored_at > self.ttl:
+            del self._results[key]
+            raise KeyError(key)
+        return value
+
+    async def get(self, user_id, quiz_id):
+        """(level, created_at), None — теста не было; False — БД недоступна"""
+        key = (user_id, quiz_id)
+        try:
+            value = self._cached(key)
+        except KeyError:
+            pass
+        else:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    return False
+                row = await conn.fetchrow('''
+                    SELECT level, created_at
+                    FROM quiz_results
+                    WHERE user_id = $1 AND quiz_id = $2
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ''', user_id, quiz_id)
+        except Exception as e:
+            # Ошибку соединения уже учёл автомат отключения в get_db_connection()
+            logging.error(f"Error reading latest quiz result for {user_id}: {e}")
+            return False
+
+        # Результат мог быть записан, пока шёл запрос, — он новее прочитанного
+        if key in self._results:
+            return self._results[key][0]
+        value = (row['level'], row['created_at']) if row else None
+        self._store(key, value)
+        return value
+
+def parse_legacy_result(quiz, message_text):
+    """Разбор строки "Результат теста - Уровень: X. Ответы: Q1: ..., Q2: ...".
+
+    Возвращает (level, answers, free_answers) или None, если формат не тот.
+    """
+    match = LEGACY_RESULT_RE.match(message_text or '')
+    if not match:
+        return None
+    level, answers_text = match.groups()
+
+    # Ответы разделены ", Q<n>: "; свободный ответ последний и может содержать запятые
+    keys = [question.key.upper() for question in quiz.questions]
+    pattern = ', '.join(f'{re.escape(key)}: (.*?)' for key in keys)
+    parts = re.match(f'^{pattern}$', answers_text, re.S)
+    if not parts:
+        return None
+
+    answers = []
+    free_answers = []
+    for question, value in zip(quiz.questions, parts.groups()):
+        if question.options:
+            index = question.options.index(value) if value in question.options else None
+            answers.append(index)
+        else:
+            answers.append(None)
+            free_answers.append(None if value == 'N/A' else value)
+    return level, answers, free_answers
+
+async def backfill_quiz_results(quiz, chunk_size=BACKFILL_CHUNK):
+    """Перенос старых текстовых результатов из mss_chat в quiz_results.
+
+    Строки читаются курсором порциями по chunk_size, так что память не
+    растёт с размером журнала. Каждая порция идёт через COPY во временную
+    таблицу и оттуда в quiz_results; повторный запуск безопасен —
+    дубликаты отсекает уникальный индекс (user_id, quiz_id, created_at).
+    """
+    copied = skipped = 0
+    async with get_db_connection() as conn:
+        if not conn:
+            return None
+
+        async with conn.transaction():
+            await conn.execute('''
+                CREATE TEMP TABLE quiz_results_backfill (
+                    quiz_id VARCHAR(64),
+                    user_id BIGINT,
+                    level VARCHAR(64),
+                    answers SMALLINT[],
+                    free_answers TEXT[],
+                    created_at TIMESTAMP
+                ) ON COMMIT DROP
+            ''')
+            cursor = await conn.cursor('''
+                SELECT user_id, message_text, created_at
+                FROM mss_chat
+                WHERE message_type = 'test_result'
+            ''')
+            while True:
+                rows = await cursor.fetch(chunk_size)
+                if not rows:
+                    break
+
+                batch = []
+                for row in rows:
+                    parsed = parse_legacy_result(quiz, row['message_text'])
+                    if parsed is None:
+                        skipped += 1
+                        continue
+                    level, answers, free_answers = parsed
+                    batch.append((quiz.quiz_id, row['user_id'], level, answers, free_answers, row['created_at']))
+
+                if batch:
+                    await conn.copy_records_to_table(
+                        'quiz_results_backfill', records=batch, columns=QUIZ_RESULT_COLUMNS
+                    )
+                    result = await conn.execute('''
+                        INSERT INTO quiz_results (quiz_id, user_id, level, answers, free_answers, created_at)
+                        SELECT quiz_id, user_id, level, answers, free_answers, created_at
+                        FROM quiz_results_backfill
+                        ON CONFLICT DO NOTHING
+                    ''')
+                    await conn.execute('TRUNCATE quiz_results_backfill')
+                    copied += int(result.split()[-1])
+                logging.info(f"Quiz results backfill: {copied} copied, {skipped} skipped")
+
+    return copied, skipped
+
+async def main():
+    from test_module import MINI_TEST
+
+    logging.basicConfig(level=logging.INFO)
+    await create_pool()
+    try:
+        result = await backfill_quiz_results(MINI_TEST)
+        if result is None:
+            logging.error("Quiz results backfill: database unavailable")
+    finally:
+        await close_pool()
+
+if __name__ == '__main__':
+    asyncio.run(main())
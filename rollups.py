@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import date, timedelta
+
+from config import ROLLUP_USERS_KEEP_DAYS
+from db import get_db_connection
+
+# Для этих типов сообщений текст — это кнопка или команда, по нему и группируем
+BUTTON_MESSAGE_TYPES = frozenset(('menu_button', 'command'))
+
+def rollup_key(message_text, message_type, created_at):
+    message_type = message_type or ''
+    button = (message_text or '') if message_type in BUTTON_MESSAGE_TYPES else ''
+    return created_at.date(), message_type, button
+
+async def add_to_rollups(conn, records):
+    """Учёт пакета записей mss_chat в дневных сводках.
+
+    Вызывается в той же транзакции, что и COPY пакета, поэтому сводки
+    всегда совпадают с журналом. users увеличивается только для
+    пользователей, впервые встреченных в этот день с этой кнопкой.
+    """
+    events = Counter()
+    users = set()
+    for user_id, _, message_text, message_type, created_at in records:
+        key = rollup_key(message_text, message_type, created_at)
+        events[key] += 1
+        users.add(key + (user_id,))
+
+    # Одинаковый порядок строк у всех процессов — без взаимных блокировок
+    event_rows = sorted(events.items())
+    user_rows = sorted(users)
+
+    await conn.execute('''
+        WITH new_users AS (
+            INSERT INTO mss_chat_daily_users (day, message_type, button, user_id)
+            SELECT * FROM unnest($1::date[], $2::varchar[], $3::text[], $4::bigint[])
+            ON CONFLICT DO NOTHING
+            RETURNING day, message_type, button
+        ), user_counts AS (
+            SELECT day, message_type, button, count(*) AS users
+            FROM new_users
+            GROUP BY day, message_type, button
+        )
+        INSERT INTO mss_chat_daily (day, message_type, button, events, users)
+        SELECT e.day, e.message_type, e.button, e.events, COALESCE(u.users, 0)
+        FROM unnest($5::date[], $6::varchar[], $7::text[], $8::bigint[])
+             AS e(day, message_type, button, events)
+        LEFT JOIN user_counts u USING (day, message_type, button)
+        ORDER BY e.day, e.message_type, e.button
+        ON CONFLICT (day, message_type, button) DO UPDATE SET
+            events = mss_chat_daily.events + EXCLUDED.events,
+            users = mss_chat_daily.users + EXCLUDED.users
+    ''',
+        [row[0] for row in user_rows], [row[1] for row in user_rows],
+        [row[2] for row in user_rows], [row[3] for row in user_rows],
+        [key[0] for key, _ in event_rows], [key[1] for key, _ in event_rows],
+        [key[2] for key, _ in event_rows], [count for _, count in event_rows],
+    )
+
+async def fetch_stats(days):
+    """Итоги за последние days дней только из сводок"""
+    async with get_db_connection() as conn:
+        if not conn:
+            return None
+        return await conn.fetch('''
+            SELECT message_type, button, sum(events) AS events, sum(users) AS users
+            FROM mss_chat_daily
+            WHERE day > $1
+            GROUP BY message_type, button
+            ORDER BY events DESC
+        ''', date.today() - timedelta(days=days))
+
+async def prune_daily_users(keep_days=ROLLUP_USERS_KEEP_DAYS):
+    try:
+        async with get_db_connection() as conn:
+            if not conn:
+                return
+            await conn.execute(
+                'DELETE FROM mss_chat_daily_users WHERE day < $1', date.today() - timedelta(days=keep_days)
+            )
+    except Exception as e:
+        logging.error(f"Error pruning rollup users: {e}")
+
+async def run_rollup_maintenance(interval=3600):
+    while True:
+        await asyncio.sleep(interval)
+        await prune_daily_users()
+
+def format_stats(rows, days):
+    lines = [f"📊 Статистика за {days} дн. (событий / польз. по дням)", ""]
+    by_type = Counter()
+    for row in rows:
+        by_type[row['message_type']] += row['events']
+
+    for message_type, count in by_type.most_common():
+        lines.append(f"{message_type or '—'}: {count}")
+
+    buttons = [row for row in rows if row['button']]
+    if buttons:
+        lines += ["", "Кнопки и команды:"]
+        for row in buttons:
+            lines.append(f"{row['button']}: {row['events']} / {row['users']}")
+    return "\n".join(lines)
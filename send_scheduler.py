@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    SEND_GLOBAL_RATE,
+    SEND_GLOBAL_BURST,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_GROUP_RATE,
+    SEND_MAX_RETRIES,
+    SEND_CHAT_BUCKETS,
+)
+
+# Полосы приоритета: ответы пользователям обслуживаются раньше массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = ('interactive', 'bulk')
+
+send_priority = ContextVar('send_priority', default=INTERACTIVE)
+
+@contextmanager
+def bulk_sending():
+    """Все запросы внутри блока идут по полосе массовой отправки"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Сколько ждать до свободного токена"""
+        self._refill(now)
+        pause = max(0.0, self.paused_until - now)
+        if self.tokens >= 1:
+            return pause
+        return max(pause, (1 - self.tokens) / self.rate)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now):
+        """Занять токен в долг; возвращает задержку до момента, когда он станет нашим"""
+        self._refill(now)
+        self.tokens -= 1
+        pause = max(0.0, self.paused_until - now)
+        if self.tokens >= 0:
+            return pause
+        return max(pause, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов Bot API с учётом лимитов Telegram.
+
+    Запросы с chat_id проходят через бакет своего чата и общий бакет бота.
+    Из общего бакета токены раздаются по полосам приоритета: пока есть
+    ожидающие интерактивные ответы, массовая отправка стоит. На 429 запрос
+    повторяется после retry_after, а чат ставится на паузу.
+    Запросы без chat_id (getUpdates, answerCallbackQuery, ...) не ограничиваются.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, global_burst=SEND_GLOBAL_BURST,
+                 chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 group_rate=SEND_GROUP_RATE, max_retries=SEND_MAX_RETRIES,
+                 chat_buckets=SEND_CHAT_BUCKETS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets = chat_buckets
+
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = OrderedDict()  # chat_id -> TokenBucket
+        self._lanes = (deque(), deque())
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+        # Метрики
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_queue_depth = [0, 0]
+
+    def share_global_limit(self, parts):
+        """Деление общего лимита бота между parts процессами"""
+        self._global.rate /= parts
+        self._global.capacity = max(1.0, self._global.capacity / parts)
+        self._global.tokens = min(self._global.tokens, self._global.capacity)
+
+    def queue_depth(self):
+        return {LANE_NAMES[lane]: len(waiters) for lane, waiters in enumerate(self._lanes)}
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': dict(zip(LANE_NAMES, self.max_queue_depth)),
+            'sent': self.sent,
+            'retries': self.retries,
+            'failed': self.failed,
+            'chat_buckets': len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные chat_id — группы и каналы, у них лимит строже
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.chat_buckets:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id, priority):
+        delay = self._chat_bucket(chat_id).reserve(time.monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Свободный токен и пустые очереди — без ожидания
+        if not self._lanes[INTERACTIVE] and not self._lanes[BULK] \
+                and self._global.wait_time(time.monotonic()) == 0:
+            self._global.take(time.monotonic())
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        lane = self._lanes[priority]
+        lane.append(waiter)
+        self.max_queue_depth[priority] = max(self.max_queue_depth[priority], len(lane))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        self._wakeup.set()
+        await waiter
+
+    async def _pump(self):
+        """Раздача токенов общего бакета ожидающим по приоритету"""
+        while self._lanes[INTERACTIVE] or self._lanes[BULK]:
+            delay = self._global.wait_time(time.monotonic())
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    # Новый интерактивный запрос не должен ждать дольше нужного
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for lane in self._lanes:
+                while lane and lane[0].done():
+                    lane.popleft()  # отменённые ожидания
+                if lane:
+                    self._global.take(time.monotonic())
+                    lane.popleft().set_result(None)
+                    break
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                logging.warning(f"Flood control in chat {chat_id}, retry {attempt} after {e.retry_after}s")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+
+def install_send_scheduler(bot, scheduler=None):
+    """Подключение планировщика к сессии бота"""
+    scheduler = scheduler or SendScheduler()
+    bot.session.middleware(scheduler)
+    return scheduler
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from datetime import datetime
+
+import db
+from config import SPOOL_DIR, SPOOL_FSYNC_MS, SPOOL_REPLAY_SEC, SPOOL_REPLAY_BATCH
+
+# Заголовок записи: длина и CRC32 полезной нагрузки
+HEADER = struct.Struct('>II')
+
+def encode_record(kind, payload):
+    data = json.dumps([kind, payload], ensure_ascii=False, default=_encode_value).encode()
+    return HEADER.pack(len(data), zlib.crc32(data)) + data
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot spool {type(value).__name__}")
+
+def read_segment(path):
+    """Записи сегмента: (смещение, конец записи, тип, данные).
+
+    Чтение останавливается на первой неполной или повреждённой записи —
+    это хвост, который не успел дойти до диска перед падением.
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length or zlib.crc32(data) != crc:
+                logging.warning(f"Spool: {path} is truncated at offset {offset}")
+                return
+            kind, payload = json.loads(data)
+            end = offset + HEADER.size + length
+            yield offset, end, kind, payload
+            offset = end
+
+class Spool:
+    """Локальный журнал записей в БД на время её недоступности.
+
+    Записи дописываются в конец текущего сегмента (длина, CRC32, JSON),
+    fsync выполняется пачкой раз в fsync_ms. Когда цепь БД замкнута,
+    фоновая задача закрывает сегмент и переносит закрытые сегменты в
+    Postgres порциями по replay_batch записей. Каждая порция помечается
+    в mss_spool_replayed диапазоном смещений в той же транзакции, поэтому
+    после падения посреди переноса (даже с другим replay_batch) ничего не
+    запишется дважды.
+
+    Порция, которую БД отвергла не из-за соединения, переносится по одной
+    записи; запись, которая не проходит и так, откладывается в каталог
+    quarantine процесса, и перенос идёт дальше.
+
+    У каждого процесса свой каталог: сегменты другого живого процесса
+    не трогаются.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, fsync_ms=SPOOL_FSYNC_MS,
+                 replay_interval=SPOOL_REPLAY_SEC, replay_batch=SPOOL_REPLAY_BATCH):
+        self.directory = directory
+        self.fsync_interval = fsync_ms / 1000
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+        self.path = None
+        self.name = None
+        self.spooled = 0
+        self.replayed = 0
+
+        self._file = None
+        self._segment = None
+        self._dirty = False
+        self._tasks = []
+
+    def open(self, name='main'):
+        """Каталог процесса; незакрытые сегменты прошлого запуска закрываются"""
+        self.name = name
+        self.path = os.path.join(self.directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        for filename in os.listdir(self.path):
+            if filename.endswith('.open'):
+                source = os.path.join(self.path, filename)
+                os.replace(source, source[:-len('.open')] + '.log')
+
+    def start(self):
+        if self.path is not None and not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run_fsync()),
+                asyncio.create_task(self._run_replay()),
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.sync()
+        self._close_segment()
+
+    @property
+    def pending_segments(self):
+        if self.path is None:
+            return []
+        return sorted(f for f in os.listdir(self.path) if f.endswith('.log'))
+
+    def append_users(self, users):
+        self._append('users', users)
+
+    def append_activity(self, activity):
+        self._append('activity', list(activity.items()))
+
+    def append_chat(self, batch):
+        self._append('chat', batch)
+
+    def _append(self, kind, payload):
+        if self.path is None:
+            # Журнал не включён (нет DATABASE_URL): как и раньше, теряются только записи mss_chat
+            if kind == 'chat':
+                logging.error(f"Chat log: database unavailable, lost {len(payload)} records")
+            return
+
+        try:
+            if self._file is None:
+                self._segment = os.path.join(self.path, f"{time.time_ns():020d}.open")
+                self._file = open(self._segment, 'ab')
+            self._file.write(encode_record(kind, payload))
+            self._dirty = True
+            self.spooled += len(payload)
+        except OSError as e:
+            logging.error(f"Spool write error, lost {len(payload)} {kind} records: {e}")
+
+    async def sync(self):
+        """Сброс буфера и fsync текущего сегмента"""
+        if self._file is None or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            self._file.flush()
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+        except OSError as e:
+            logging.error(f"Spool fsync error: {e}")
+
+    def _close_segment(self):
+        """Текущий сегмент закрывается и становится доступным для переноса"""
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._segment, self._segment[:-len('.open')] + '.log')
+        self._file = None
+        self._segment = None
+
+    async def _run_fsync(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            await self.sync()
+
+    async def _run_replay(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            if self._file is None and not self.pending_segments:
+                continue
+            if db.pool is None:
+                # Пул не создался при старте — пробуем снова
+                await db.create_pool(init=db.pool_init)
+            try:
+                await self.replay()
+            except Exception as e:
+                logging.error(f"Spool replay error: {e}")
+
+    async def replay(self):
+        """Перенос закрытых сегментов в БД; False, если БД недоступна"""
+        async with db.get_db_connection() as conn:
+            if not conn:
+                return False
+
+            await self.sync()
+            self._close_segment()
+            for filename in self.pending_segments:
+                await self._replay_segment(conn, filename)
+        return True
+
+    async def _replay_segment(self, conn, filename):
+        segment = f"{self.name}/{filename}"
+        # Уже перенесённые диапазоны [chunk_offset, end_offset); у отметок,
+        # сделанных до появления end_offset, конца нет — их порция режется
+        # по replay_batch, как и раньше, и пропускается по конфликту ключа
+        replayed = dict(await conn.fetch(
+            'SELECT chunk_offset, end_offset FROM mss_spool_replayed WHERE segment = $1', segment
+        ))
+        chunk = []
+        chunk_size = 0
+        skip_until = 0
+        for record in read_segment(os.path.join(self.path, filename)):
+            offset, end, kind, payload = record
+            if offset < skip_until:
+                continue
+            if replayed.get(offset) is not None:
+                if chunk:
+                    await self._replay_records(conn, segment, chunk)
+                    chunk = []
+                    chunk_size = 0
+                skip_until = replayed[offset]
+                continue
+            chunk.append(record)
+            chunk_size += len(payload)
+            if chunk_size >= self.replay_batch:
+                await self._replay_records(conn, segment, chunk)
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            await self._replay_records(conn, segment, chunk)
+
+        os.remove(os.path.join(self.path, filename))
+        await conn.execute('DELETE FROM mss_spool_replayed WHERE segment = $1', segment)
+        logging.info(f"Spool: replayed {segment}")
+
+    async def _replay_records(self, conn, segment, records):
+        """Перенос порции; порция, отвергнутая БД, — по одной записи, иначе в карантин"""
+        try:
+            await self._replay_chunk(conn, segment, records)
+            return
+        except Exception as e:
+            if db.is_connection_error(e):
+                raise
+            error = e
+
+        if len(records) > 1:
+            logging.warning(f"Spool: chunk at {segment}:{records[0][0]} failed, replaying records one by one: {error}")
+            for record in records:
+                await self._replay_records(conn, segment, [record])
+            return
+
+        offset, end, kind, payload = records[0]
+        await asyncio.to_thread(self._write_quarantine, segment, encode_record(kind, payload))
+        await conn.execute('''
+            INSERT INTO mss_spool_replayed (segment, chunk_offset, end_offset)
+            VALUES ($1, $2, $3)
+            ON CONFLICT DO NOTHING
+        ''', segment, offset, end)
+        logging.error(f"Spool: {kind} record at {segment}:{offset} moved to quarantine: {error}")
+
+    def _write_quarantine(self, segment, data):
+        """Отложенная запись в формате сегмента: её можно перенести вручную"""
+        directory = os.path.join(self.path, 'quarantine')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, os.path.basename(segment)), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _replay_chunk(self, conn, segment, records):
+        from chat_log import write_chat_batch
+        from user_cache import update_activity, upsert_users
+
+        users, activity, chat = [], {}, []
+        for _, _, kind, payload in records:
+            if kind == 'users':
+                users += [tuple(row[:4]) + (datetime.fromisoformat(row[4]),) for row in payload]
+            elif kind == 'activity':
+                for user_id, when in payload:
+                    when = datetime.fromisoformat(when)
+                    if activity.get(user_id, when) <= when:
+                        activity[user_id] = when
+            elif kind == 'chat':
+                for record in payload:
+                    chat.append((*record[:4], datetime.fromisoformat(record[4]), *record[5:]))
+
+        async with conn.transaction():
+            claimed = await conn.fetchval('''
+                INSERT INTO mss_spool_replayed (segment, chunk_offset, end_offset)
+                VALUES ($1, $2, $3)
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            ''', segment, records[0][0], records[-1][1])
+            if not claimed:
+                # Уже перенесено до перезапуска
+                return
+            if users:
+                await upsert_users(conn, users)
+            if activity:
+                await update_activity(conn, activity)
+            if chat:
+                await write_chat_batch(conn, chat)
+        self.replayed += len(users) + len(activity) + len(chat)
+
+# Журнал процесса; включается spool.open() при заданном DATABASE_URL
+spool = Spool()
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from config import SUPPORT_DIGEST_SEC, SUPPORT_MAP_SIZE
+from db import get_db_connection
+
+# "#12 текст" — ответ на конкретный вопрос из сводки
+TICKET_REF_RE = re.compile(r'^#(\d+)\s+(.+)$', re.S)
+
+@dataclass
+class Ticket:
+    id: int
+    user_id: int
+    chat_id: int
+    user_name: str
+    question: str
+    created_at: datetime
+    status: str = 'open'
+
+    def admin_text(self):
+        return (f"🆘 Вопрос #{self.id}\n\n"
+                f"👤 От: {self.user_name}\n"
+                f"📝 Вопрос: {self.question}\n\n"
+                f"Отправлено: {self.created_at.strftime('%d.%m.%Y %H:%M')}")
+
+class SupportDesk:
+    """Очередь вопросов в поддержку с ответами через reply.
+
+    Каждый вопрос сохраняется в support_tickets и пересылается
+    администратору; id его сообщения запоминается в памяти, так что ответ
+    администратора (reply на это сообщение) находит пользователя одним
+    словарным поиском. Если сообщения нет в памяти (перезапуск, другой
+    процесс), тикет ищется по индексу admin_message_id.
+
+    При digest_interval > 0 первый вопрос уходит сразу, а следующие за
+    digest_interval секунд собираются в одно сообщение-сводку; ответ на
+    сводку начинается с "#<номер вопроса>".
+    """
+
+    def __init__(self, bot, admin_chat_id, digest_interval=SUPPORT_DIGEST_SEC, map_size=SUPPORT_MAP_SIZE):
+        self.bot = bot
+        self.admin_chat_id = admin_chat_id
+        self.digest_interval = digest_interval
+        self.map_size = map_size
+
+        self._by_admin_message = OrderedDict()  # id сообщения администратору -> [Ticket]
+        self._pending = []
+        self._digest_task = None
+
+    def _remember(self, admin_message_id, tickets):
+        self._by_admin_message[admin_message_id] = tickets
+        self._by_admin_message.move_to_end(admin_message_id)
+        if len(self._by_admin_message) > self.map_size:
+            self._by_admin_message.popitem(last=False)
+
+    async def load_open(self):
+        """Открытые тикеты в память при старте (частичный индекс по status = 'open')"""
+        async with get_db_connection() as conn:
+            if not conn:
+                return
+            rows = await conn.fetch('''
+                SELECT id, user_id, chat_id, user_name, question, created_at, status, admin_message_id
+                FROM support_tickets
+                WHERE status = 'open' AND admin_message_id IS NOT NULL
+                ORDER BY created_at
+            ''')
+
+        for row in rows:
+            ticket = Ticket(*(row[key] for key in ('id', 'user_id', 'chat_id', 'user_name', 'question', 'created_at', 'status')))
+            self._by_admin_message.setdefault(row['admin_message_id'], []).append(ticket)
+
+    async def open_tickets(self, limit=20):
+        async with get_db_connection() as conn:
+            if not conn:
+                return None
+            return await conn.fetch('''
+                SELECT id, user_name, question, created_at
+                FROM support_tickets
+                WHERE status = 'open'
+                ORDER BY created_at
+                LIMIT $1
+            ''', limit)
+
+    async def submit(self, message):
+        """Новый вопрос; False, если передать его администратору не удалось"""
+        user = message.from_user
+        user_info = f"@{user.username}" if user.username else f"ID: {user.id}"
+        ticket = Ticket(
+            id=0,
+            user_id=user.id,
+            chat_id=message.chat.id,
+            user_name=f"{user.full_name} ({user_info})",
+            question=message.text or '',
+            created_at=message.date.replace(tzinfo=None),
+        )
+
+        try:
+            async with get_db_connection() as conn:
+                if conn:
+                    ticket.id = await conn.fetchval('''
+                        INSERT INTO support_tickets (user_id, chat_id, user_name, question, created_at)
+                        VALUES ($1, $2, $3, $4, $5)
+                        RETURNING id
+                    ''', ticket.user_id, ticket.chat_id, ticket.user_name, ticket.question, ticket.created_at)
+        except Exception as e:
+            logging.error(f"Error saving support ticket: {e}")
+
+        if not ticket.id:
+            # Без БД отвечать через reply нельзя — пересылаем как раньше
+            return await self._send_plain(ticket)
+
+        if self.digest_interval > 0:
+            self._pending.append(ticket)
+            if self._digest_task is None:
+                self._digest_task = asyncio.create_task(self._run_digest())
+            return True
+        return await self._send([ticket])
+
+    async def _send_plain(self, ticket):
+        text = (f"🆘 Новый вопрос от пользователя бота:\n\n"
+                f"👤 От: {ticket.user_name}\n"
+                f"📝 Вопрос: {ticket.question}\n\n"
+                f"Отправлено: {ticket.created_at.strftime('%d.%m.%Y %H:%M')}")
+        try:
+            await self.bot.send_message(chat_id=self.admin_chat_id, text=text)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to send message to admin: {e}")
+            return False
+
+    async def _send(self, tickets):
+        if len(tickets) == 1:
+            text = tickets[0].admin_text() + "\n\n↩️ Ответьте на это сообщение, чтобы отправить ответ пользователю"
+        else:
+            text = "\n\n".join(
+                [f"🆘 Новых вопросов: {len(tickets)}"]
+                + [ticket.admin_text() for ticket in tickets]
+                + ["↩️ Ответьте на это сообщение текстом «#номер ответ»"]
+            )
+
+        try:
+            sent = await self.bot.send_message(chat_id=self.admin_chat_id, text=text)
+        except Exception as e:
+            logging.error(f"Failed to send message to admin: {e}")
+            return False
+
+        self._remember(sent.message_id, tickets)
+        try:
+            async with get_db_connection() as conn:
+                if conn:
+                    await conn.execute(
+                        'UPDATE support_tickets SET admin_message_id = $1 WHERE id = ANY($2::bigint[])',
+                        sent.message_id, [ticket.id for ticket in tickets],
+                    )
+        except Exception as e:
+            logging.error(f"Error saving support admin message id: {e}")
+        return True
+
+    async def _run_digest(self):
+        """Первый вопрос сразу, остальные — сводкой раз в digest_interval, пока идёт всплеск"""
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                await self._send(batch)
+                await asyncio.sleep(self.digest_interval)
+        finally:
+            self._digest_task = None
+
+    async def stop(self):
+        if self._digest_task is not None:
+            self._digest_task.cancel()
+            try:
+                await self._digest_task
+            except asyncio.CancelledError:
+                pass
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._send(batch)
+
+    async def find(self, admin_message_id):
+        """Тикеты, пересланные сообщением admin_message_id"""
+        tickets = self._by_admin_message.get(admin_message_id)
+        if tickets is not None:
+            return tickets
+
+        async with get_db_connection() as conn:
+            if not conn:
+                return None
+            rows = await conn.fetch('''
+                SELECT id, user_id, chat_id, user_name, question, created_at, status
+                FROM support_tickets
+                WHERE admin_message_id = $1
+                ORDER BY id
+            ''', admin_message_id)
+        if not rows:
+            return None
+
+        tickets = [Ticket(*row.values()) for row in rows]
+        self._remember(admin_message_id, tickets)
+        return tickets
+
+    async def reply(self, tickets, message):
+        """Ответ администратора; (тикет, ошибка) — ошибка None, если ответ доставлен.
+
+        Текст уходит пользователю вместе с вопросом; фото, голосовое и
+        прочее копируется copy_message после заголовка с вопросом. Номер
+        «#номер» для сводки берётся из текста или подписи.
+        """
+        text = message.text if message.text is not None else message.caption
+        ticket = tickets[0] if len(tickets) == 1 else None
+        match = TICKET_REF_RE.match(text or '')
+        if match:
+            ticket_id = int(match.group(1))
+            ticket = next((t for t in tickets if t.id == ticket_id), None)
+            text = match.group(2)
+        if ticket is None:
+            return None, "Начните ответ (или подпись) с номера вопроса: «#номер ответ»"
+
+        header = f"💬 Ответ ведущего курса на ваш вопрос:\n\n📝 {ticket.question}"
+        try:
+            if message.text is not None:
+                await self.bot.send_message(chat_id=ticket.chat_id, text=f"{header}\n\n{text}")
+            else:
+                await self.bot.send_message(chat_id=ticket.chat_id, text=header)
+                # Подпись без «#номер»; без номера copy_message оставляет исходную
+                await self.bot.copy_message(
+                    chat_id=ticket.chat_id,
+                    from_chat_id=message.chat.id,
+                    message_id=message.message_id,
+                    caption=text if match else None,
+                )
+        except Exception as e:
+            logging.error(f"Failed to send support answer to {ticket.user_id}: {e}")
+            return ticket, str(e)
+
+        ticket.status = 'answered'
+        try:
+            async with get_db_connection() as conn:
+                if conn:
+                    await conn.execute('''
+                        UPDATE support_tickets SET status = 'answered', answered_at = $2 WHERE id = $1
+                    ''', ticket.id, datetime.now())
+        except Exception as e:
+            logging.error(f"Error updating support ticket {ticket.id}: {e}")
+        return ticket, None
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+from config import THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MODE, THROTTLE_MAX_USERS
+
+THROTTLE_WARNING = "⏳ Слишком много сообщений подряд. Подождите немного, и я отвечу."
+
+class Throttler(BaseMiddleware):
+    """Антифлуд по пользователю на GCRA.
+
+    На пользователя хранится одно число — теоретическое время прихода
+    следующего сообщения (TAT) — в OrderedDict не больше max_users
+    записей; давно не писавшие вытесняются первыми (LRU). Вытеснение
+    ничего не ломает: запись без истории равна «лимит не тратился».
+
+    Что делать с сообщением сверх лимита (mode):
+    - "drop" — молча отбросить;
+    - "coalesce" — отложить до момента, когда лимит позволит, оставив
+      только последнее из отложенных сообщений пользователя;
+    - "warn" — отбросить и один раз предупредить пользователя, пока он
+      не вернётся в лимит.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, mode=THROTTLE_MODE,
+                 max_users=THROTTLE_MAX_USERS, exempt=()):
+        if mode not in ('drop', 'coalesce', 'warn'):
+            raise ValueError(f"Unknown throttle mode: {mode}")
+
+        self.interval = 1 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.mode = mode
+        self.max_users = max_users
+        self.exempt = frozenset(exempt)
+        self.throttled = 0
+
+        self._tat = OrderedDict()  # user_id -> TAT
+        self._warned = set()
+        self._pending = {}         # user_id -> (handler, event, data) для coalesce
+
+    def __len__(self):
+        return len(self._tat)
+
+    def hit(self, user_id, now):
+        """Учёт сообщения; 0, если оно в лимите, иначе сколько ждать до следующего"""
+        tat = self._tat.get(user_id)
+        if tat is None or tat < now:
+            tat = now
+        elif tat - now > self.tolerance:
+            self._tat.move_to_end(user_id)
+            return tat - now - self.tolerance
+
+        self._tat[user_id] = tat + self.interval
+        self._tat.move_to_end(user_id)
+        if len(self._tat) > self.max_users:
+            evicted, _ = self._tat.popitem(last=False)
+            self._warned.discard(evicted)
+        return 0.0
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        delay = self.hit(user.id, time.monotonic())
+        if not delay:
+            self._warned.discard(user.id)
+            return await handler(event, data)
+
+        self.throttled += 1
+        if self.mode == 'coalesce':
+            self._defer(user.id, handler, event, data, delay)
+        elif self.mode == 'warn' and user.id not in self._warned:
+            self._warned.add(user.id)
+            await self._warn(data['bot'], user.id)
+        return None
+
+    def _defer(self, user_id, handler, event, data, delay):
+        if user_id in self._pending:
+            # Уже ждёт своей очереди — заменяем на более новое
+            self._pending[user_id] = (handler, event, data)
+            return
+        if len(self._pending) >= self.max_users:
+            return
+
+        self._pending[user_id] = (handler, event, data)
+        asyncio.get_running_loop().call_later(delay, self._release, user_id)
+
+    def _release(self, user_id):
+        pending = self._pending.pop(user_id, None)
+        if pending is not None:
+            asyncio.create_task(self._run_deferred(*pending))
+
+    async def _run_deferred(self, handler, event, data):
+        try:
+            await self(handler, event, data)
+        except Exception as e:
+            logging.error(f"Error processing deferred update: {e}")
+
+    @staticmethod
+    async def _warn(bot, chat_id):
+        try:
+            await bot.send_message(chat_id=chat_id, text=THROTTLE_WARNING)
+        except Exception as e:
+            logging.error(f"Failed to send throttle warning to {chat_id}: {e}")
+
+def install_throttler(dp, exempt=()):
+    """Антифлуд до фильтров и хэндлеров сообщений и нажатий кнопок"""
+    throttler = Throttler(exempt=exempt)
+    dp.message.outer_middleware(throttler)
+    dp.callback_query.outer_middleware(throttler)
+    return throttler
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_ACTIVITY_FLUSH_SEC
+from db import get_db_connection, is_connection_error
+from spool import spool
+
+class UserProfileCache:
+    """LRU/TTL-кэш последних сохранённых в mss_users профилей.
+
+    Пока профиль пользователя (username, first_name, last_name) не менялся,
+    upsert в mss_users не нужен: достаточно запомнить время активности.
+    Накопленные last_activity периодически записываются одним UPDATE.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL,
+                 flush_interval=USER_ACTIVITY_FLUSH_SEC):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._profiles = OrderedDict()  # user_id -> (profile, время сохранения)
+        self._activity = {}             # user_id -> последняя активность
+        self._task = None
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def is_fresh(self, user_id, profile):
+        """True, если в mss_users уже лежит именно этот профиль"""
+        entry = self._profiles.get(user_id)
+        if entry is None:
+            return False
+
+        cached_profile, stored_at = entry
+        if cached_profile != profile or time.monotonic() - stored_at > self.ttl:
+            del self._profiles[user_id]
+            return False
+
+        self._profiles.move_to_end(user_id)
+        return True
+
+    def remember(self, user_id, profile):
+        self._profiles[user_id] = (profile, time.monotonic())
+        self._profiles.move_to_end(user_id)
+        if len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+        # upsert уже записал свежее время активности
+        self._activity.pop(user_id, None)
+
+    def forget(self, user_id):
+        self._profiles.pop(user_id, None)
+
+    def touch(self, user_id, when):
+        self._activity[user_id] = when
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Запись накопленных last_activity одним UPDATE ... FROM unnest(...)"""
+        if not self._activity:
+            return
+
+        activity, self._activity = self._activity, {}
+        try:
+            async with get_db_connection() as conn:
+                if not conn:
+                    spool.append_activity(activity)
+                    return
+
+                await update_activity(conn, activity)
+        except Exception as e:
+            logging.error(f"Error flushing user activity to database: {e}")
+            if is_connection_error(e):
+                spool.append_activity(activity)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+async def update_activity(conn, activity):
+    """last_activity для {user_id: время}; более свежие значения в БД не трогаются"""
+    await conn.execute('''
+        UPDATE mss_users AS u
+        SET last_activity = v.last_activity, blocked_at = NULL
+        FROM unnest($1::bigint[], $2::timestamp[]) AS v(user_id, last_activity)
+        WHERE u.user_id = v.user_id AND u.last_activity < v.last_activity
+    ''', list(activity.keys()), list(activity.values()))
+
+async def upsert_users(conn, users):
+    """Пакетный upsert профилей [(user_id, username, first_name, last_name, last_activity)].
+
+    Для повторной записи из локального журнала: профиль, сохранённый
+    позже, не перезаписывается более старым.
+    """
+    latest = {}
+    for row in users:
+        if row[0] not in latest or latest[row[0]][4] <= row[4]:
+            latest[row[0]] = row
+    rows = [latest[user_id] for user_id in sorted(latest)]
+
+    await conn.execute('''
+        INSERT INTO mss_users (user_id, username, first_name, last_name, last_activity)
+        SELECT * FROM unnest($1::bigint[], $2::varchar[], $3::varchar[], $4::varchar[], $5::timestamp[])
+        ON CONFLICT (user_id)
+        DO UPDATE SET
+            username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            last_name = EXCLUDED.last_name,
+            last_activity = EXCLUDED.last_activity,
+            blocked_at = NULL
+        WHERE mss_users.last_activity <= EXCLUDED.last_activity
+    ''', *([row[i] for row in rows] for i in range(5)))
+
+# Общий кэш процесса
+user_profiles = UserProfileCache()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+import db
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_DRAIN_TIMEOUT,
+)
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Приём обновлений с проверкой секрета и корректной остановкой.
+
+    После начала остановки новые обновления получают 503 (Telegram доставит
+    их повторно другой реплике), а уже принятые дорабатываются в drain().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.draining = False
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return web.Response(text="Shutting down", status=503)
+        if not request.app["ready"]:
+            # Ещё идёт прогрев: Telegram повторит доставку
+            return web.Response(text="Starting", status=503)
+        return await super().handle(request)
+
+    async def drain(self, timeout):
+        """Ожидание обработки уже принятых обновлений"""
+        self.draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+
+        logging.info(f"Webhook: draining {len(tasks)} in-flight updates")
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logging.warning(f"Webhook: {len(pending)} updates were not finished in {timeout}s")
+
+async def health_handler(request: web.Request) -> web.Response:
+    """Liveness: процесс жив и отвечает"""
+    return web.json_response({"status": "ok"})
+
+async def ready_handler(request: web.Request) -> web.Response:
+    """Readiness: сервис принимает обновления"""
+    handler = request.app["webhook_handler"]
+    ready = request.app["ready"] and not handler.draining
+    return web.json_response({
+        "status": "ready" if ready else "not_ready",
+        "database": db.pool is not None,
+        "in_flight": handler.in_flight,
+    }, status=200 if ready else 503)
+
+def create_app(dp, bot, secret_token=WEBHOOK_SECRET):
+    """aiohttp-приложение с приёмом обновлений и проверками здоровья"""
+    app = web.Application()
+    handler = DrainingRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token or None,
+        handle_in_background=True,
+    )
+    # Сессию бота закрывает main(), а не остановка веб-сервера
+    app.router.add_route("POST", WEBHOOK_PATH, handler.handle)
+    app.router.add_get("/healthz", health_handler)
+    app.router.add_get("/readyz", ready_handler)
+
+    app["webhook_handler"] = handler
+    app["ready"] = False
+    return app
+
+async def register_webhook(dp, bot):
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info("Webhook registered in Telegram")
+
+async def run_webhook(dp, bot, warm_up=None):
+    """Работа в режиме webhook до SIGTERM/SIGINT.
+
+    Сервер начинает слушать порт сразу (проверка /healthz проходит),
+    warm_up и регистрация webhook идут параллельно; обновления
+    принимаются, когда оба закончились.
+    """
+    app = create_app(dp, bot)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    logging.info(f"Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    setup = [warm_up] if warm_up is not None else []
+    if WEBHOOK_URL:
+        setup.append(register_webhook(dp, bot))
+    else:
+        logging.warning("WEBHOOK_URL is not set, webhook is not registered in Telegram")
+    try:
+        # Ошибка прогрева (например, миграции) останавливает процесс
+        await asyncio.gather(*setup)
+    except BaseException:
+        await runner.cleanup()
+        raise
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    app["ready"] = True
+    try:
+        await stop_event.wait()
+        logging.info("Webhook: shutdown signal received")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await app["webhook_handler"].drain(WEBHOOK_DRAIN_TIMEOUT)
+        await runner.cleanup()
@@ -0,0 +1,377 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import signal
+import threading
+
+import aiohttp
+from aiohttp import web
+
+from config import (
+    BOT_MODE,
+    DATABASE_URL,
+    WORKER_QUEUE_SIZE,
+    WORKER_CONCURRENCY,
+    WORKER_STOP_TIMEOUT,
+    WORKER_START_TIMEOUT,
+    POLLING_TIMEOUT,
+    METRICS_ENABLED,
+    METRICS_PORT,
+    ARCHIVE_AFTER_DAYS,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+)
+
+# Как часто при запуске проверяется, не завершился ли процесс
+READY_POLL_SEC = 0.5
+
+def shard_key(update):
+    """id пользователя (или чата), по которому обновление закрепляется за процессом"""
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        sender = event.get('from') or event.get('user')
+        if sender:
+            return sender['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+class WorkerPool:
+    """Процессы-обработчики, между которыми обновления делятся по пользователю.
+
+    Все обновления одного пользователя попадают в один процесс, поэтому
+    порядок его сообщений и состояние FSM остаются согласованными. У каждого
+    процесса свои Dispatcher, сессия бота и пул соединений с БД.
+
+    setup — функция уровня модуля, вызывается в процессе с модулем bot
+    до начала работы (например, чтобы подменить сессию в бенчмарке).
+    """
+
+    def __init__(self, workers, setup=None, queue_size=WORKER_QUEUE_SIZE):
+        self.workers = workers
+        self.setup = setup
+        self.queue_size = queue_size
+
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._processes = []
+        self._results = self._context.Queue()
+
+    def start(self):
+        for index in range(self.workers):
+            updates = self._context.Queue(maxsize=self.queue_size)
+            process = self._context.Process(
+                target=_worker_process,
+                args=(index, self.workers, updates, self._results, self.setup),
+                name=f"mss-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+
+    async def wait_ready(self, timeout=WORKER_START_TIMEOUT):
+        """Ожидание, пока все процессы импортируют бота и поднимут пул.
+
+        RuntimeError, если процесс завершился при запуске (ошибка импорта,
+        падение) или за timeout секунд готовы не все.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        ready = 0
+        while ready < self.workers:
+            for process in self._processes:
+                if process.exitcode is not None:
+                    raise RuntimeError(f"{process.name} exited with code {process.exitcode} during startup")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise RuntimeError(f"{self.workers - ready} of {self.workers} workers not ready in {timeout}s")
+            try:
+                await loop.run_in_executor(None, self._results.get, True, min(remaining, READY_POLL_SEC))
+            except queue.Empty:
+                continue
+            ready += 1
+
+    async def terminate(self, timeout=WORKER_STOP_TIMEOUT):
+        """Аварийная остановка без доработки очередей (сбой при запуске)"""
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+        self._queues, self._processes = [], []
+
+    async def dispatch(self, update):
+        updates = self._queues[shard_key(update) % self.workers]
+        try:
+            updates.put_nowait(update)
+        except queue.Full:
+            # Процесс не успевает — ждём места, не блокируя цикл событий
+            await asyncio.get_running_loop().run_in_executor(None, updates.put, update)
+
+    async def stop(self, timeout=WORKER_STOP_TIMEOUT):
+        """Остановка с доработкой принятых обновлений; возвращает счётчики процессов"""
+        loop = asyncio.get_running_loop()
+        for updates in self._queues:
+            await loop.run_in_executor(None, updates.put, None)
+
+        processed = {}
+        for _ in self._processes:
+            try:
+                index, count = await loop.run_in_executor(None, self._results.get, True, timeout)
+                processed[index] = count
+            except queue.Empty:
+                break
+
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning(f"{process.name} did not stop in {timeout}s, terminating")
+                process.terminate()
+
+        self._queues, self._processes = [], []
+        return processed
+
+def _worker_process(index, workers, updates, results, setup):
+    # Остановкой управляет процесс-распределитель
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_worker_main(index, workers, updates, results, setup))
+
+async def _worker_main(index, workers, updates, results, setup):
+    import bot as bot_module
+    from chat_log import chat_log
+    from db import create_pool, close_pool
+    from pg_storage import PostgresStorage
+    from spool import spool
+    from user_cache import user_profiles
+
+    if setup is not None:
+        setup(bot_module)
+    bot, dp = bot_module.bot, bot_module.dp
+    if bot_module.send_scheduler is not None:
+        # Лимит Telegram общий на бота, а не на процесс
+        bot_module.send_scheduler.share_global_limit(workers)
+
+    await create_pool(init=bot_module.metrics_pool_init)
+    if DATABASE_URL:
+        spool.open(f"worker-{index}")
+        spool.start()
+    chat_log.start()
+    user_profiles.start()
+    if isinstance(dp.storage, PostgresStorage):
+        dp.storage.start()
+    if bot_module.dedup is not None:
+        bot_module.dedup.start()
+    # Каждую прерванную рассылку подхватит один процесс (advisory lock)
+    await bot_module.broadcaster.resume()
+    await bot_module.support_desk.load_open()
+    metrics_runner = None
+    if METRICS_ENABLED:
+        # У каждого процесса свой порт: METRICS_PORT + номер процесса
+        from metrics import start_metrics_server
+        metrics_runner = await start_metrics_server(port=METRICS_PORT + index)
+    maintenance_tasks = []
+    if index == 0:
+        from migrations import run_partition_maintenance
+        from rollups import run_rollup_maintenance
+        maintenance_tasks = [
+            asyncio.create_task(run_partition_maintenance()),
+            asyncio.create_task(run_rollup_maintenance()),
+        ]
+        if ARCHIVE_AFTER_DAYS > 0:
+            from archive import run_archive_maintenance
+            maintenance_tasks.append(asyncio.create_task(run_archive_maintenance()))
+
+    # Блокирующее чтение очереди процесса — в отдельном потоке
+    loop = asyncio.get_running_loop()
+    local_updates = asyncio.Queue()
+
+    def reader():
+        while True:
+            update = updates.get()
+            loop.call_soon_threadsafe(local_updates.put_nowait, update)
+            if update is None:
+                return
+
+    threading.Thread(target=reader, name="update-reader", daemon=True).start()
+    results.put((index, 'ready'))
+
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    tails = {}  # пользователь -> последняя задача его цепочки
+    tasks = set()
+    processed = 0
+
+    async def process(update, previous):
+        nonlocal processed
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with semaphore:
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                logging.error(f"Error processing update {update.get('update_id')}: {e}")
+        processed += 1
+
+    def done(task, key):
+        tasks.discard(task)
+        if tails.get(key) is task:
+            del tails[key]
+
+    while True:
+        update = await local_updates.get()
+        if update is None:
+            break
+
+        key = shard_key(update)
+        task = asyncio.create_task(process(update, tails.get(key)))
+        tails[key] = task
+        tasks.add(task)
+        task.add_done_callback(lambda t, key=key: done(t, key))
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+    for task in maintenance_tasks:
+        task.cancel()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    if bot_module.dedup is not None:
+        await bot_module.dedup.stop()
+    await bot_module.broadcaster.stop()
+    await bot_module.support_desk.stop()
+    await chat_log.stop()
+    await user_profiles.stop()
+    await spool.stop()
+    await dp.storage.close()
+    await bot.session.close()
+    await close_pool()
+    results.put((index, processed))
+
+async def poll_updates(bot, pool, allowed_updates, stop_event):
+    """Long polling без разбора обновлений в моделях: сырые JSON уходят процессам"""
+    url = bot.session.api.api_url(token=bot.token, method='getUpdates')
+    offset = None
+
+    async with aiohttp.ClientSession() as http:
+        while not stop_event.is_set():
+            params = {'timeout': POLLING_TIMEOUT, 'allowed_updates': allowed_updates}
+            if offset is not None:
+                params['offset'] = offset
+
+            try:
+                request = http.post(url, json=params, timeout=aiohttp.ClientTimeout(total=POLLING_TIMEOUT + 10))
+                stop_wait = asyncio.ensure_future(stop_event.wait())
+                fetch = asyncio.ensure_future(_fetch_json(request))
+                await asyncio.wait([fetch, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+                stop_wait.cancel()
+                if not fetch.done():
+                    fetch.cancel()
+                    break
+                payload = fetch.result()
+            except Exception as e:
+                logging.error(f"Polling error: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not payload.get('ok'):
+                retry_after = payload.get('parameters', {}).get('retry_after', 1)
+                logging.error(f"Polling error: {payload.get('description')}")
+                await asyncio.sleep(retry_after)
+                continue
+
+            for update in payload['result']:
+                await pool.dispatch(update)
+                offset = update['update_id'] + 1
+
+        # Подтверждаем Telegram уже разданные обновления
+        if offset is not None:
+            try:
+                await _fetch_json(http.post(url, json={'offset': offset, 'timeout': 0, 'limit': 1}))
+            except Exception as e:
+                logging.error(f"Failed to confirm polling offset: {e}")
+
+async def _fetch_json(request):
+    async with request as response:
+        return await response.json()
+
+def create_receiver_app(pool, secret_token=WEBHOOK_SECRET):
+    """Приём webhook в распределителе: обновление сразу уходит процессу"""
+    async def receive(request):
+        if secret_token and not secrets.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token
+        ):
+            return web.Response(text="Unauthorized", status=401)
+        if request.app['draining']:
+            return web.Response(text="Shutting down", status=503)
+        await pool.dispatch(await request.json())
+        return web.json_response({})
+
+    async def health(request):
+        return web.json_response({"status": "ok"})
+
+    async def ready(request):
+        is_ready = not request.app['draining']
+        return web.json_response({"status": "ready" if is_ready else "not_ready", "workers": pool.workers},
+                                 status=200 if is_ready else 503)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    app.router.add_get('/healthz', health)
+    app.router.add_get('/readyz', ready)
+    app['draining'] = False
+    return app
+
+async def run_supervisor(bot, dp, workers):
+    """Распределитель: получает обновления (polling или webhook) и раздаёт их процессам"""
+    pool = WorkerPool(workers)
+    pool.start()
+    try:
+        await pool.wait_ready()
+    except RuntimeError:
+        await pool.terminate()
+        await bot.session.close()
+        raise
+    logging.info(f"Started {workers} worker processes")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        if BOT_MODE == 'webhook':
+            app = create_receiver_app(pool)
+            runner = web.AppRunner(app, handle_signals=False)
+            await runner.setup()
+            await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=allowed_updates,
+                )
+            try:
+                await stop_event.wait()
+            finally:
+                app['draining'] = True
+                await runner.cleanup()
+        else:
+            await bot.delete_webhook()
+            await poll_updates(bot, pool, allowed_updates, stop_event)
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        processed = await pool.stop()
+        logging.info(f"Workers stopped, processed updates: {processed}")
+        await bot.session.close()